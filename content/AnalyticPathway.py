@@ -0,0 +1,205 @@
+# A class to estimate queue sizes and waits on the GSTT hand surgery pathway
+# in milliseconds, from the average rate of each stage, without simulating
+# patients - a quick first answer while the full simulation runs
+
+import math
+from bisect import bisect_right
+
+from HandPathway import Hand_Surgery_Pathway
+
+
+class Analytic_Hand_Surgery_Pathway(Hand_Surgery_Pathway):
+
+    # stages in pathway order
+    stages = ('clinic_q', 'imaging_q', 'therapy_q', 'theatre_q')
+
+    # days per step of the fluid model - queues are kept once per day
+    step = 0.1
+
+    # most days past sim_duration the fluid model is run for - waits of
+    # patients reaching a stage after then come from its queue growing or
+    # shrinking at the rate it had, so projections stay quick however long
+    # the waits are
+    max_projection = 1825
+
+    # method to return the average number of patients a clinic or theatre
+    # list sees per day - appointments start through a one day session, the
+    # last finishing after it if need be, then it closes for interval days.
+    # With a whole number of appointments the last ends just as the session
+    # closes, and with rounding one more starts about half the time
+    @staticmethod
+    def session_rate(appointments, interval):
+        seen = math.ceil(appointments)
+        if seen == appointments:
+            seen += 0.5
+        length = max(seen / appointments, 1)
+        return seen / (length + interval)
+
+    # method to return the average number of patients each stage sees per
+    # day - imaging and therapy see one patient every interval days
+    def service_rates(self):
+        return {'clinic_q': self.session_rate(self.surg_clinic_appts, self.surg_clinic_interval),
+                'imaging_q': 1 / self.imaging_interval,
+                'therapy_q': 1 / self.therapy_interval,
+                'theatre_q': self.session_rate(self.adjusted_theatre_capacity,
+                                               self.theatre_list_interval)}
+
+    # method to return the average number of referrals reaching each stage
+    # per day
+    def arrival_rates(self):
+        referrals = 1 / self.referral_interval
+        return {'clinic_q': referrals,
+                'imaging_q': referrals * self.prob_needs_imaging,
+                'therapy_q': referrals * self.prob_needs_therapy,
+                'theatre_q': referrals}
+
+    # method to return the days a patient arriving at an empty queue waits
+    # on average, in the long run - the G/D/1 (Kingman) wait of a
+    # deterministic appointment length with random arrivals, plus, for
+    # clinics and theatres, waiting for the next session if it is closed.
+    # Infinite if the stage sees fewer patients than are referred to it
+    def steady_state_waits(self):
+        service = self.service_rates()
+        arrival = self.arrival_rates()
+        closed = {'clinic_q': self.surg_clinic_interval,
+                  'theatre_q': self.theatre_list_interval}
+
+        waits = {}
+        for stage in self.stages:
+            utilisation = arrival[stage] / service[stage]
+            if utilisation >= 1:
+                waits[stage] = math.inf
+                continue
+            waits[stage] = utilisation / (2 * service[stage] * (1 - utilisation))
+            if stage in closed:
+                interval = closed[stage]
+                waits[stage] += interval / (1 + interval) * interval / 2
+        return waits
+
+    # method to project the numbers in each queue each day until until,
+    # treating patients as a fluid - each stage serves at its rate while it
+    # has a queue, and passes patients on to the next stage they need.
+    # Returns the days and a list of queue sizes per stage
+    def project_queues(self, until):
+        service = self.service_rates()
+        referrals = 1 / self.referral_interval
+        p_imaging = self.prob_needs_imaging
+        p_therapy = self.prob_needs_therapy
+        step = self.step
+        steps_per_day = round(1 / step)
+
+        queues = {'clinic_q': self.fill_clinic_q, 'imaging_q': self.fill_imaging_q,
+                  'therapy_q': self.fill_therapy_q, 'theatre_q': self.fill_theatre_q}
+        times = [0]
+        trajectory = {stage: [queues[stage]] for stage in self.stages}
+
+        # function to serve a stage for a step, returning the patients seen
+        def serve(stage, arriving):
+            seen = min(service[stage] * step, queues[stage] + arriving)
+            queues[stage] += arriving - seen
+            return seen
+
+        for i in range(1, math.ceil(until) * steps_per_day + 1):
+            # each patient seen in clinic or imaging needs therapy with the
+            # same probability, whether or not they needed imaging
+            seen_clinic = serve('clinic_q', referrals * step)
+            seen_imaging = serve('imaging_q', seen_clinic * p_imaging)
+            past_imaging = seen_clinic * (1 - p_imaging) + seen_imaging
+            seen_therapy = serve('therapy_q', past_imaging * p_therapy)
+            serve('theatre_q', past_imaging * (1 - p_therapy) + seen_therapy)
+
+            if i % steps_per_day == 0:
+                times.append(i // steps_per_day)
+                for stage in self.stages:
+                    trajectory[stage].append(queues[stage])
+        return times, trajectory
+
+    # method to return the patients each stage's queue grows by per day, once
+    # queues are the given sizes - in the fluid model a stage with a queue,
+    # or more patients arriving than it can see, sees patients at its rate
+    # and passes them on, and otherwise passes on those arriving
+    def growth_rates(self, queues):
+        service = self.service_rates()
+        p_imaging = self.prob_needs_imaging
+        p_therapy = self.prob_needs_therapy
+        growth = {}
+
+        def serve(stage, arriving):
+            seen = service[stage] if queues[stage] > 0 else min(service[stage], arriving)
+            growth[stage] = arriving - seen
+            return seen
+
+        seen_clinic = serve('clinic_q', 1 / self.referral_interval)
+        seen_imaging = serve('imaging_q', seen_clinic * p_imaging)
+        past_imaging = seen_clinic * (1 - p_imaging) + seen_imaging
+        seen_therapy = serve('therapy_q', past_imaging * p_therapy)
+        serve('theatre_q', past_imaging * (1 - p_therapy) + seen_therapy)
+        return growth
+
+    # method to estimate the total wait of a patient referred on each day,
+    # from the queue ahead of them at each stage they reach (or the steady
+    # state wait, if longer), appointment lengths in clinic, imaging and
+    # therapy, and the probabilities of needing imaging and therapy. Queues
+    # at stages without enough capacity grow, so their waits are all queue.
+    # Queues after the last day projected change at their growth rates then
+    def project_waits(self, days, times, trajectory):
+        service = self.service_rates()
+        steady = {stage: wait if math.isfinite(wait) else 0
+                  for stage, wait in self.steady_state_waits().items()}
+        growth = self.growth_rates({stage: trajectory[stage][-1] for stage in self.stages})
+
+        def wait(stage, time):
+            queue = trajectory[stage][bisect_right(times, time) - 1]
+            if time > times[-1]:
+                queue = max(queue + growth[stage] * (time - times[-1]), 0)
+            return max(queue / service[stage], steady[stage])
+
+        waits = []
+        for day in days:
+            time = day + wait('clinic_q', day) + self.surg_clinic_duration
+            time += self.prob_needs_imaging * (wait('imaging_q', time) + self.imaging_interval)
+            time += self.prob_needs_therapy * (wait('therapy_q', time) + self.therapy_interval)
+            waits.append(time + wait('theatre_q', time) - day)
+        return waits
+
+    # method to project the queues up to sim_duration and the waits of
+    # patients referred on each day, returning a dict of the projections
+    # and the same readouts as the simulation's results
+    def project(self):
+        if self.schedule is not None:
+            raise ValueError('The analytic engine uses average rates over the whole run, '
+                             'so does not support schedule - use the simpy or slot engine')
+
+        # run the fluid model on past sim_duration, long enough for the last
+        # referrals to reach theatres, or for max_projection days
+        days = list(range(self.sim_duration))
+        until = self.sim_duration
+        longest = self.sim_duration + self.max_projection
+        while True:
+            times, trajectory = self.project_queues(until)
+            waits = self.project_waits([day + 0.5 for day in days], times, trajectory)
+            if self.sim_duration + waits[-1] <= until or until >= longest:
+                break
+            until = min((self.sim_duration + waits[-1]) * 1.25, longest)
+
+        at_end = bisect_right(times, self.sim_duration) - 1
+        end_queues = {stage: trajectory[stage][at_end] for stage in self.stages}
+        return {'times': times[:at_end + 1],
+                'queues': {stage: trajectory[stage][:at_end + 1] for stage in self.stages},
+                'referral_days': days,
+                'waits': waits,
+                'end_queues': end_queues,
+                'total_q': sum(end_queues.values()),
+                'wait_time_start': waits[0],
+                'wait_time_end': waits[-1],
+                'steady_state_waits': self.steady_state_waits()}
+
+    # method to return the projected queue sizes as a dataframe with a row
+    # per day up to sim_duration
+    @classmethod
+    def queues_df(cls, projection):
+        import pandas as pd
+
+        df = pd.DataFrame({'time': projection['times'], **projection['queues']})
+        df['total_q'] = df[list(cls.stages)].sum(axis=1)
+        return df.set_index('time')
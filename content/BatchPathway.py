@@ -0,0 +1,244 @@
+# A class to simulate many replications of the GSTT hand surgery pathway at
+# once, as numpy arrays with one row per replication
+
+import numpy as np
+
+from HandPathway import Hand_Surgery_Pathway
+from ResultsRecorder import Wait_Time_Recorder, Queue_Length_Recorder, Run_Results
+from global_params import g
+
+
+# function to find start times at a stage with no closures (imaging and
+# therapy) for rows of arrivals in FIFO order, with np.inf after the last
+# patient at the stage. A patient starts at the later of their arrival and
+# the previous patient's end, which unrolls to a running maximum
+def fifo_slot_starts(arrivals, duration):
+    steps = np.arange(arrivals.shape[1]) * duration
+    return steps + np.maximum.accumulate(arrivals - steps, axis=1)
+
+
+# function to find start times at a stage that closes between sessions
+# (clinics and theatre lists) for rows of arrivals in FIFO order, following
+# clinic_unavail/theatres_unavail as in SlotPathway.session_slot_starts
+def session_slot_starts(arrivals, duration, interval):
+    rows, columns = arrivals.shape
+    starts = np.full(arrivals.shape, np.inf)
+    free = np.zeros(rows)
+    closes = np.ones(rows)
+
+    for k in range(columns):
+        arrival = arrivals[:, k]
+        active = arrival < np.inf
+        if not active.any():
+            break
+
+        start = np.maximum(arrival, free)
+        blocked = active & (start >= closes)
+        while blocked.any():
+            reopens = np.maximum(closes[blocked], free[blocked]) + interval
+            closes[blocked] = reopens + 1
+            free[blocked] = reopens
+            start[blocked] = np.maximum(arrival[blocked], reopens)
+            blocked = active & (start >= closes)
+
+        starts[active, k] = start[active]
+        free[active] = start[active] + duration
+
+    return starts
+
+
+# function to find start times at a stage for arrivals in patient order,
+# with np.inf for patients who skip it - each row is put in FIFO order
+# (ties keep patient order), passed to slot_starts and put back
+def stage_starts(arrivals, slot_starts, *args):
+    order = np.argsort(arrivals, axis=1, kind='stable')
+    sorted_starts = slot_starts(np.take_along_axis(arrivals, order, axis=1), *args)
+    starts = np.empty_like(sorted_starts)
+    np.put_along_axis(starts, order, sorted_starts, axis=1)
+    return np.where(arrivals < np.inf, starts, np.inf)
+
+
+# function to count patients who have arrived at a stage but not started at
+# each of times, for each row of arrivals and starts (np.inf for patients
+# who skip it)
+def count_waiting_at(arrivals, starts, times):
+    sorted_arrivals = np.sort(arrivals, axis=1)
+    sorted_starts = np.sort(starts, axis=1)
+    return np.array([np.searchsorted(row_arrivals, times, side='right') -
+                     np.searchsorted(row_starts, times, side='right')
+                     for row_arrivals, row_starts in zip(sorted_arrivals, sorted_starts)])
+
+
+class Batch_Hand_Surgery_Pathway(Hand_Surgery_Pathway):
+
+    def __init__(self, number_of_runs = g.number_of_runs, first_run_number = 0,
+                 chunk_size = g.batch_chunk_size, seed = None, **params):
+
+        # runs are numbered from first_run_number, and all draws come from
+        # one numpy generator so a batch is reproducible from its seed.
+        # Runs are simulated chunk_size at a time to bound memory use
+        super().__init__(first_run_number, seed=seed, **params)
+        for option in ('stop_at_horizon', 'common_random_numbers', 'schedule'):
+            if getattr(self, option):
+                raise ValueError(f'The batch engine does not support {option} - '
+                                 'use the simpy or slot engine')
+        self.number_of_runs = number_of_runs
+        self.chunk_size = chunk_size
+        self.np_rng = np.random.default_rng(seed)
+
+    # method to sample arrival times and routing for every patient in every
+    # run. Columns are the clinic, imaging, therapy and theatre prefills in
+    # turn, then number_of_referrals referrals
+    def sample_patients(self, runs, number_of_referrals):
+        fill_clinic = self.fill_clinic_q
+        fill_imaging = self.fill_imaging_q
+        fill_therapy = self.fill_therapy_q
+        fill_theatre = self.fill_theatre_q
+
+        # referral times - the first referral is at time zero
+        inter_referral = self.np_rng.exponential(self.referral_interval,
+                                                 (runs, number_of_referrals - 1))
+        referral_times = np.hstack([np.zeros((runs, 1)),
+                                    np.cumsum(inter_referral, axis=1)])
+
+        # routing for patients who have not yet been seen - prefilled
+        # imaging and therapy patients need those by definition
+        def routing(prob, columns):
+            return self.np_rng.random((runs, columns)) < prob
+
+        needs_imaging = np.hstack([
+            routing(self.prob_needs_imaging, fill_clinic),
+            np.ones((runs, fill_imaging), dtype=bool),
+            np.zeros((runs, fill_therapy + fill_theatre), dtype=bool),
+            routing(self.prob_needs_imaging, number_of_referrals)])
+        needs_therapy = np.hstack([
+            routing(self.prob_needs_therapy, fill_clinic + fill_imaging),
+            np.ones((runs, fill_therapy), dtype=bool),
+            np.zeros((runs, fill_theatre), dtype=bool),
+            routing(self.prob_needs_therapy, number_of_referrals)])
+
+        prefills = self.total_fill_queues
+        entered = np.hstack([np.zeros((runs, prefills)), referral_times])
+
+        is_referral = np.zeros(prefills + number_of_referrals, dtype=bool)
+        is_referral[prefills:] = True
+        sees_clinic = np.zeros(prefills + number_of_referrals, dtype=bool)
+        sees_clinic[:fill_clinic] = True
+        sees_clinic[prefills:] = True
+
+        return entered, needs_imaging, needs_therapy, is_referral, sees_clinic
+
+    # method to find every patient's arrival and start times at each stage,
+    # returning the end of simulation time of each run and per stage
+    # (arrivals, starts) arrays
+    def assign_slots(self, entered, needs_imaging, needs_therapy, sees_clinic):
+
+        # time each patient is ready for their next stage - prefilled
+        # patients are ready at time zero for the stage they are queued at
+        ready = np.zeros(entered.shape)
+
+        clinic_arrivals = np.where(sees_clinic, entered, np.inf)
+        clinic_starts = stage_starts(clinic_arrivals, session_slot_starts,
+                                     self.surg_clinic_duration,
+                                     self.surg_clinic_interval)
+        ready = np.where(sees_clinic, clinic_starts + self.surg_clinic_duration, ready)
+
+        imaging_arrivals = np.where(needs_imaging, ready, np.inf)
+        imaging_starts = stage_starts(imaging_arrivals, fifo_slot_starts,
+                                      self.imaging_interval)
+        ready = np.where(needs_imaging, imaging_starts + self.imaging_interval, ready)
+
+        therapy_arrivals = np.where(needs_therapy, ready, np.inf)
+        therapy_starts = stage_starts(therapy_arrivals, fifo_slot_starts,
+                                      self.therapy_interval)
+        ready = np.where(needs_therapy, therapy_starts + self.therapy_interval, ready)
+
+        theatre_arrivals = ready
+        theatre_starts = stage_starts(theatre_arrivals, session_slot_starts,
+                                      self.theatre_case_duration,
+                                      self.theatre_list_interval)
+
+        # each run ends once sim_duration has passed and every patient
+        # referred before then has been through theatres
+        before_end_sim = entered < self.sim_duration
+        discharged = np.where(before_end_sim,
+                              theatre_starts + self.theatre_case_duration, -np.inf)
+        end = np.maximum(self.sim_duration, discharged.max(axis=1))
+
+        stages = [(clinic_arrivals, clinic_starts),
+                  (imaging_arrivals, imaging_starts),
+                  (therapy_arrivals, therapy_starts),
+                  (theatre_arrivals, theatre_starts)]
+        return end, stages
+
+    # method to run a chunk of replications, returning a Run_Results per run
+    def run_chunk(self, first_run, runs):
+
+        # sample enough referrals to cover the end of every run, estimated
+        # from a first pass. Stages only depend on earlier arrivals, so
+        # referrals after the end of a run cannot change its result
+        horizon = self.sim_duration
+        while True:
+            number_of_referrals = int(horizon * 1.25 / self.referral_interval) + 50
+            entered, needs_imaging, needs_therapy, is_referral, sees_clinic = \
+                self.sample_patients(runs, number_of_referrals)
+            end, stages = self.assign_slots(entered, needs_imaging,
+                                            needs_therapy, sees_clinic)
+            if (entered[:, -1] > end).all():
+                break
+            horizon = end.max()
+
+        # numbers in each queue at the end of each run
+        end_queues = np.column_stack([
+            ((arrivals <= end[:, None]) & (starts >= end[:, None])).sum(axis=1)
+            for arrivals, starts in stages])
+
+        # queue times of referred patients, in the order they reached theatres
+        clinic_starts = stages[0][1]
+        theatre_arrivals, theatre_starts = stages[-1]
+        recorded = is_referral & (entered < self.sim_duration)
+
+        # numbers in each queue at each sample time
+        if self.queue_sample_interval is not None:
+            interval, times = self.queue_sample_times()
+            sampled_queues = [count_waiting_at(arrivals, starts, times)
+                              for arrivals, starts in stages]
+
+        run_results = []
+        for run in range(runs):
+            in_run = recorded[run]
+            order = np.argsort(theatre_starts[run, in_run], kind='stable')
+            time_entered_pathway = entered[run, in_run][order]
+            theatre_start = theatre_starts[run, in_run][order]
+
+            wait_times = Wait_Time_Recorder.from_columns(
+                time_entered_pathway=time_entered_pathway,
+                overall_q_time=theatre_start - time_entered_pathway,
+                clinic_q_time=clinic_starts[run, in_run][order] - time_entered_pathway,
+                theatre_q_time=theatre_start - theatre_arrivals[run, in_run][order])
+
+            queue_lengths = None
+            if self.queue_sample_interval is not None:
+                clinic_q, imaging_q, therapy_q, theatre_q = [
+                    queues[run] for queues in sampled_queues]
+                queue_lengths = Queue_Length_Recorder.from_columns(
+                    interval, time=times, clinic_q=clinic_q, imaging_q=imaging_q,
+                    therapy_q=therapy_q, theatre_q=theatre_q)
+
+            run_results.append(Run_Results(first_run + run, wait_times,
+                                           *end_queues[run].tolist(),
+                                           queue_lengths=queue_lengths))
+
+        return run_results
+
+    # A method to run every replication, returning a Run_Results per run -
+    # profiler is only accepted to match Hand_Surgery_Pathway.run
+    def run(self, profiler=None):
+        if profiler is not None:
+            raise ValueError('Only the simpy engine can be profiled')
+
+        run_results = []
+        for first in range(0, self.number_of_runs, self.chunk_size):
+            runs = min(self.chunk_size, self.number_of_runs - first)
+            run_results += self.run_chunk(self.run_number + first, runs)
+        return run_results
@@ -0,0 +1,309 @@
+# A class to snapshot a Hand_Surgery_Pathway part way through a run, and
+# restore it to carry on - after a crash, or to branch several policy
+# variants from one shared warmed up state instead of simulating it again
+
+import heapq
+import inspect
+import os
+import pickle
+from collections import deque
+
+from simpy.events import Initialize, Process, Timeout
+
+from HandPathway import Hand_Surgery_Pathway
+
+
+# parameters the model's processes and recorders were set up with, which a
+# restored model cannot change
+fixed_parameters = ('bulk_prefill', 'queue_sample_interval', 'stop_at_horizon',
+                    'common_random_numbers')
+
+# counters copied from the model as they are
+counters = ('patient_counter', 'active_entities',
+            'clinic_q', 'imaging_q', 'therapy_q', 'theatre_q')
+
+# streams of random numbers besides the model's own generator
+rng_streams = ('arrival', 'referral_imaging', 'referral_therapy',
+               'prefill_imaging', 'prefill_therapy')
+
+# local variables of enter_pathway holding when a patient started queueing
+queue_start_locals = {'clinic_q': 'start_q_clinic', 'theatre_q': 'start_q_theatres'}
+
+
+# function to copy plain data, through pickle as it is several times faster
+# than copy.deepcopy
+def deep_copy(data):
+    return pickle.loads(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+# function to return the generator a process is running - the innermost one
+# if it has handed over to another with yield from
+def running_generator(process):
+    generator = process._generator
+    while generator.gi_yieldfrom is not None:
+        generator = generator.gi_yieldfrom
+    return generator
+
+
+class Pathway_Snapshot:
+    def __init__(self, time, model_class, run_number, seed, parameters, counters,
+                 rng_states, processes, recorder, queue_lengths, in_pathway):
+
+        # simulated day of the snapshot, what is needed to build the model,
+        # and the seed the run started from
+        self.time = time
+        self.model_class = model_class
+        self.run_number = run_number
+        self.seed = seed
+        self.parameters = parameters
+
+        self.counters = counters
+        self.rng_states = rng_states
+
+        # the processes to start again, in order - each the name of a model
+        # method making the process, its arguments (with stages named by
+        # their queue counter in place of resources) and the time its
+        # timeout was due, if it was waiting on one
+        self.processes = processes
+
+        # results recorded so far, and patients tracked if stopping at
+        # sim_duration
+        self.recorder = recorder
+        self.queue_lengths = queue_lengths
+        self.in_pathway = in_pathway
+
+    # method to snapshot a model run with run_until, from its simpy
+    # environment - every process is waiting on either a resource request
+    # (held or queued) or a timeout, so is described by what it is running,
+    # which resource it holds or queues for and the days left on its timeout.
+    # Relies on simpy internals (the event queue, and the generator each
+    # process runs)
+    @classmethod
+    def capture(cls, model):
+        if type(model).run is not Hand_Surgery_Pathway.run:
+            raise ValueError('Only the simpy engine can be snapshotted')
+        if not model.started:
+            raise ValueError('The run has not started - call run_until first')
+        if model.finished():
+            raise ValueError('The run has already ended')
+
+        env = model.env
+        now = env.now
+        services = model.stage_services()
+
+        # requests held and queued for at each stage, by process
+        holding, queued = {}, {}
+        for stage, (resource, duration) in services.items():
+            for req in resource.users:
+                holding[req.proc] = stage
+            for req in resource.queue:
+                queued[req.proc] = stage
+
+        # processes waiting on a timeout, in the order their timeouts would
+        # fire, then processes queueing for each stage in queue order, so
+        # restarting them in this order keeps ties and queues in order
+        due = {}
+        for time, priority, eid, event in sorted(env._queue, key=lambda entry: entry[:3]):
+            for callback in event.callbacks or ():
+                process = getattr(callback, '__self__', None)
+                if isinstance(process, Process):
+                    if not isinstance(event, Timeout):
+                        raise ValueError('Processes have not started yet - '
+                                         'run the model past time zero first')
+                    due[process] = time
+
+        processes = []
+        for process in list(due) + list(queued):
+            generator = running_generator(process)
+            name = generator.gi_code.co_name
+            variables = generator.gi_frame.f_locals
+            remaining = due[process] - now if process in due else None
+
+            if name in ('enter_pathway', 'resume_pathway'):
+                stage = holding.get(process) or queued[process]
+                queued_since = None
+                if process in queued:
+                    queued_since = variables.get('queued_since',
+                                                 variables.get(queue_start_locals.get(stage)))
+                arguments = {'patient': variables['patient'], 'stage': stage,
+                             'queued_since': queued_since, 'remaining': remaining}
+                name = 'resume_pathway'
+
+            elif name == 'serve_backlog':
+                # the patient in an appointment, or queueing for one, has
+                # already been taken off the backlog
+                backlog = list(variables['backlog'])
+                if 'pt' in variables:
+                    backlog.insert(0, variables['pt'])
+                arguments = {'stage': variables['queue'], 'backlog': backlog,
+                             'remaining': remaining if process in holding else None}
+
+            elif name in ('clinic_unavail', 'theatres_unavail'):
+                if process in holding:
+                    arguments = {'closed_for': remaining}
+                elif process in queued:
+                    # waiting for the last appointment of the session to end
+                    arguments = {'open_for': 0}
+                else:
+                    arguments = {'open_for': remaining}
+
+            elif name in ('generate_referrals', 'end_of_horizon', 'sample_queue_lengths'):
+                arguments = {'delay': remaining}
+
+            else:
+                raise ValueError(f'Cannot snapshot the run while {name} is running')
+
+            processes.append((name, arguments, due.get(process)))
+
+        rng_states = {'rng': model.rng.getstate()}
+        if model.common_random_numbers:
+            for stream in rng_streams:
+                rng_states[stream] = getattr(model, f'{stream}_rng').getstate()
+
+        # copy everything the run will go on changing in one go, so patients
+        # shared between processes and in_pathway stay shared
+        processes, recorder, queue_lengths, in_pathway = deep_copy(
+            (processes, model.recorder, model.queue_lengths, model.in_pathway))
+
+        return cls(now, type(model), model.run_number, model.seed, cls.model_parameters(model),
+                   {name: getattr(model, name) for name in counters},
+                   rng_states, processes, recorder, queue_lengths, in_pathway)
+
+    # method to return the parameters a model was created with, other than
+    # its run number and seed
+    @staticmethod
+    def model_parameters(model):
+        names = inspect.signature(type(model).__init__).parameters
+        return {name: getattr(model, name) for name in names
+                if name not in ('self', 'run_number', 'seed')}
+
+    # method to return a new model carrying on from the snapshot, with any
+    # parameters in overrides changed from then on - appointments and
+    # closures under way, and the wait for the next referral, keep their
+    # lengths. Each restore gets its own copy of the patients, so a snapshot
+    # can be restored any number of times
+    def restore(self, run_number=None, **overrides):
+        fixed = [name for name in fixed_parameters
+                 if name in overrides and overrides[name] != self.parameters[name]]
+        if fixed:
+            raise ValueError(f'Cannot change {", ".join(fixed)} when restoring a snapshot')
+
+        model = self.model_class(self.run_number if run_number is None else run_number,
+                                 **{**self.parameters, **overrides})
+        model.setup_environment(self.time)
+        model.started = True
+        model.seed = self.seed
+
+        for name, value in self.counters.items():
+            setattr(model, name, value)
+
+        model.rng.setstate(self.rng_states['rng'])
+        if model.common_random_numbers:
+            for stream in rng_streams:
+                getattr(model, f'{stream}_rng').setstate(self.rng_states[stream])
+
+        processes, model.recorder, model.queue_lengths, model.in_pathway = deep_copy(
+            (self.processes, self.recorder, self.queue_lengths, self.in_pathway))
+
+        env = model.env
+        services = model.stage_services()
+        before_end = self.time < model.sim_duration
+        due, started = {}, set()
+        for name, arguments, due_time in processes:
+            if name in ('clinic_unavail', 'theatres_unavail') and model.calendars is not None:
+                # patients are booked into sessions from the schedule now
+                continue
+            if name == 'end_of_horizon':
+                # for the sim_duration restored with
+                if not before_end:
+                    continue
+                due_time = model.sim_duration
+                arguments = {'delay': due_time - self.time}
+            if name == 'serve_backlog':
+                resource, duration = services[arguments['stage']]
+                generator = model.serve_backlog(resource, deque(arguments['backlog']),
+                                                duration, arguments['stage'],
+                                                arguments['remaining'])
+            else:
+                generator = getattr(model, name)(**arguments)
+            process = env.process(generator)
+            started.add(name)
+            if due_time is not None:
+                due[process] = due_time
+
+        # with sim_duration moved on past the snapshot, the checks at
+        # sim_duration may need starting again
+        if before_end and 'end_of_horizon' not in started:
+            due[env.process(model.end_of_horizon(model.sim_duration - self.time))] = model.sim_duration
+        if model.queue_lengths is not None and 'sample_queue_lengths' not in started:
+            env.process(model.sample_queue_lengths())
+        if model.calendars is None:
+            # clinics and lists open and close by themselves again without
+            # a schedule, from the start of a session
+            for name in ('clinic_unavail', 'theatres_unavail'):
+                if name not in started:
+                    env.process(getattr(model, name)())
+        if not before_end:
+            model.check_end_of_sim()
+
+        # start the processes, then move the timeouts they wait on to exactly
+        # the times they were due - the snapshot's time plus the days left
+        # cannot always be rounded to them
+        while env._queue and isinstance(env._queue[0][3], Initialize):
+            env.step()
+        targets = {process._target: time for process, time in due.items()}
+        env._queue = [(targets.get(event, time), priority, eid, event)
+                      for time, priority, eid, event in env._queue]
+        heapq.heapify(env._queue)
+
+        return model
+
+    # method to check the snapshot is of the run model would make - the
+    # same engine, run number, seed and parameters - raising a ValueError
+    # listing what differs if not
+    def check_matches(self, model):
+        differences = []
+        if type(model) is not self.model_class:
+            differences.append(f'engine {self.model_class.__name__} (not {type(model).__name__})')
+        for name, value in [('run_number', self.run_number), ('seed', self.seed),
+                            *self.parameters.items()]:
+            if getattr(model, name) != value:
+                differences.append(f'{name} {value!r} (not {getattr(model, name)!r})')
+        if differences:
+            raise ValueError('The snapshot is of a different run - it has '
+                             + ', '.join(differences))
+
+    # method to write the snapshot to a file, replacing it in one step so a
+    # crash while writing leaves the previous snapshot
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    # method to read a snapshot written by save
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+# function to run a model to its end, snapshotting it to path every every
+# simulated days - if path already holds a snapshot, from a run of the same
+# model that was interrupted, the run carries on from there instead, and a
+# snapshot of any other run raises a ValueError. The snapshot is removed
+# once the run has ended. Returns the results of the run
+def run_with_checkpoints(model, path, every):
+    if os.path.exists(path):
+        snapshot = Pathway_Snapshot.load(path)
+        snapshot.check_matches(model)
+        model = snapshot.restore()
+
+    while not model.finished():
+        model.run_until(model.env.now + every)
+        if not model.finished():
+            Pathway_Snapshot.capture(model).save(path)
+
+    results = model.finish()
+    if os.path.exists(path):
+        os.remove(path)
+    return results
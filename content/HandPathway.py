@@ -2,11 +2,12 @@
 
 import simpy
 import random
-import numpy as np
-import pandas as pd
-import csv
+from collections import deque
+from simpy.core import StopSimulation
 
 from HandPatient import Patient
+from ResultsRecorder import Wait_Time_Recorder, Queue_Length_Recorder, Run_Results
+from Schedule import Pathway_Schedule, schedule_parameters
 from global_params import g
 
 class Hand_Surgery_Pathway:
@@ -27,14 +28,38 @@ class Hand_Surgery_Pathway:
                  fill_clinic_q = g.fill_clinic_q,
                  fill_imaging_q = g.fill_imaging_q,
                  fill_therapy_q = g.fill_therapy_q,
-                 fill_theatre_q = g.fill_theatre_q
+                 fill_theatre_q = g.fill_theatre_q,
+                 bulk_prefill = g.bulk_prefill,
+                 queue_sample_interval = g.queue_sample_interval,
+                 stop_at_horizon = g.stop_at_horizon,
+                 common_random_numbers = g.common_random_numbers,
+                 schedule = g.schedule,
+                 seed = None
                  ):
 
-        #setup environment
-        self.env = simpy.Environment()
         self.active_entities = 0
         self.patient_counter = 0
 
+        #random number generator for this run only, so runs are reproducible
+        #and can be spread across processes
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        #with common random numbers, referral times and the routing of
+        #referred and prefilled patients each have their own stream derived
+        #from the seed, so the nth referral arrives at the same time and
+        #follows the same route in every scenario run with that seed.
+        #Otherwise every stream is the single generator above
+        self.common_random_numbers = common_random_numbers
+        streams = ['arrival', 'referral_imaging', 'referral_therapy',
+                   'prefill_imaging', 'prefill_therapy']
+        for stream in streams:
+            if common_random_numbers:
+                rng = random.Random(None if seed is None else f'{seed}-{stream}')
+            else:
+                rng = self.rng
+            setattr(self, f'{stream}_rng', rng)
+
         #setup values from defaults and calculate
         self.referrals_per_week = referrals_per_week
         self.referral_interval = 7 / referrals_per_week
@@ -82,14 +107,36 @@ class Hand_Surgery_Pathway:
 
         self.total_fill_queues = fill_clinic_q + fill_imaging_q + fill_therapy_q + fill_theatre_q
 
-        #create 'end of simulation' Event
-        self.end_of_sim = self.env.event()
-
-        #setup resources
-        self.surg_clinic = simpy.PriorityResource(self.env, capacity=1)
-        self.imaging = simpy.Resource(self.env, capacity=1)
-        self.therapy = simpy.Resource(self.env, capacity=1)
-        self.theatres = simpy.PriorityResource(self.env, capacity=1)
+        #seed prefilled queues in one step rather than one process per patient
+        self.bulk_prefill = bulk_prefill
+
+        #stop at sim_duration rather than when every patient referred before
+        #then has been through theatres - patients still in the pathway are
+        #kept by id so their waits so far can be recorded as censored
+        self.stop_at_horizon = stop_at_horizon
+        self.in_pathway = {} if stop_at_horizon else None
+
+        #with a schedule of changes to capacity and demand and closures
+        #(see Schedule.Pathway_Schedule), sessions are compiled in advance
+        #and the patient at the front of each queue is booked into the next
+        #one, rather than clinics and lists being opened and closed by
+        #processes of their own. A schedule that changes nothing is run as
+        #no schedule, as compiled sessions close on time rather than after
+        #the appointment in progress
+        self.schedule = schedule
+        self.compiled_schedule = None
+        self.calendars = None
+        if schedule is not None:
+            self.compiled_schedule = Pathway_Schedule(
+                schedule, {name: getattr(self, name) for name in schedule_parameters})
+            if self.compiled_schedule.empty:
+                self.schedule = self.compiled_schedule = None
+            else:
+                self.calendars = self.compiled_schedule.stage_calendars(sim_duration)
+
+        #setup environment, end of simulation event and resources
+        self.setup_environment()
+        self.started = False
 
         self.run_number = run_number
 
@@ -99,19 +146,47 @@ class Hand_Surgery_Pathway:
         self.therapy_q = 0
         self.theatre_q = 0
 
-        #create dataframe with queue times
-        data = {'time_entered_pathway': [],
-                'overall_q_time': []}
-        self.q_times_df = pd.DataFrame(data)
+        #create recorder for queue times
+        self.recorder = Wait_Time_Recorder()
+
+        #create recorder sampling numbers in queues every
+        #queue_sample_interval days up to sim_duration, unless None
+        self.queue_sample_interval = queue_sample_interval
+        self.queue_lengths = None
+        if queue_sample_interval is not None:
+            self.queue_lengths = Queue_Length_Recorder(queue_sample_interval,
+                                                       g.queue_max_samples)
+
+    # method to create the simpy environment, starting at initial_time (a
+    # model restored from a snapshot carries on from the snapshot's time),
+    # with its 'end of simulation' Event and resources
+    def setup_environment(self, initial_time=0):
+        self.env = simpy.Environment(initial_time)
+        self.end_of_sim = self.env.event()
+
+        self.surg_clinic = simpy.PriorityResource(self.env, capacity=1)
+        self.imaging = simpy.Resource(self.env, capacity=1)
+        self.therapy = simpy.Resource(self.env, capacity=1)
+        self.theatres = simpy.PriorityResource(self.env, capacity=1)
+
+    # method to return the resource and appointment length of each stage,
+    # keyed by the name of its queue counter
+    def stage_services(self):
+        return {'clinic_q': (self.surg_clinic, self.surg_clinic_duration),
+                'imaging_q': (self.imaging, self.imaging_interval),
+                'therapy_q': (self.therapy, self.therapy_interval),
+                'theatre_q': (self.theatres, self.theatre_case_duration)}
 
     #method to determine if patient needs hand therapy
     def determine_therapy(self, patient):
-        if random.uniform(0,1) < self.prob_needs_therapy:
+        rng = self.prefill_therapy_rng if patient.from_prefills else self.referral_therapy_rng
+        if rng.uniform(0,1) < self.prob_needs_therapy:
             patient.needs_therapy = True
 
     #method to determine if patient needs imaging
     def determine_imaging(self, patient):
-        if random.uniform(0,1) < self.prob_needs_imaging:
+        rng = self.prefill_imaging_rng if patient.from_prefills else self.referral_imaging_rng
+        if rng.uniform(0,1) < self.prob_needs_imaging:
             patient.needs_imaging = True
 
     # method to determine before end sim
@@ -119,7 +194,8 @@ class Hand_Surgery_Pathway:
         if self.env.now >= self.sim_duration:
             patient.before_end_sim = False
 
-    # method to pre fill queues with set numbers
+    # method to pre fill queues with set numbers, starting a process and a
+    # zero delay timeout per patient
     def prefill_queues(self):
 
         # fill clinic queue
@@ -130,8 +206,7 @@ class Hand_Surgery_Pathway:
             self.active_entities += 1
 
             #create new patient
-            pt = Patient(self.patient_counter)
-            pt.from_prefills = True
+            pt = Patient(self.patient_counter, from_prefills=True)
 
             #decide if needs hand therapy/imaging
             self.determine_imaging(pt)
@@ -151,10 +226,8 @@ class Hand_Surgery_Pathway:
             self.active_entities += 1
 
             # create new patient who needs imaging
-            pt = Patient(self.patient_counter)
-            pt.already_seen_clinic = True
-            pt.needs_imaging = True
-            pt.from_prefills = True
+            pt = Patient(self.patient_counter, already_seen_clinic=True,
+                         needs_imaging=True, from_prefills=True)
 
             #print(f'Patient {pt.id} should go direct to imaging queue as already_seen_clinic is {pt.already_seen_clinic}')
             
@@ -178,11 +251,9 @@ class Hand_Surgery_Pathway:
             self.active_entities += 1
 
             # create new patient who needs therapy
-            pt = Patient(self.patient_counter)
-            pt.already_seen_clinic = True
-            pt.already_seen_imaging = True
-            pt.needs_therapy = True
-            pt.from_prefills = True
+            pt = Patient(self.patient_counter, already_seen_clinic=True,
+                         already_seen_imaging=True, needs_therapy=True,
+                         from_prefills=True)
 
             # no need to determine if needs imaging
             # as will skip straight to therapy queue
@@ -200,11 +271,9 @@ class Hand_Surgery_Pathway:
             self.active_entities += 1
 
             # create new patient
-            pt = Patient(self.patient_counter)
-            pt.already_seen_clinic = True
-            pt.already_seen_imaging = True
-            pt.already_seen_therapy = True
-            pt.from_prefills = True
+            pt = Patient(self.patient_counter, already_seen_clinic=True,
+                         already_seen_imaging=True, already_seen_therapy=True,
+                         from_prefills=True)
 
             # no need to determine if needs surg/imaging/therapy
             # as will skip straight to theatre queue
@@ -214,11 +283,139 @@ class Hand_Surgery_Pathway:
             # need to have yield statement so code works - timeout for zero time
             yield self.env.timeout(0)
 
-    #method to generate patient referrals
-    def generate_referrals(self):
+    # method to create the prefilled patients for each queue, in FIFO order
+    def create_prefill_patients(self):
+
+        clinic_backlog = deque()
+        imaging_backlog = deque()
+        therapy_backlog = deque()
+        theatre_backlog = deque()
+
+        # fill clinic queue, deciding if needs hand therapy/imaging
+        for i in range(self.fill_clinic_q):
+            self.patient_counter += 1
+            pt = Patient(self.patient_counter, from_prefills=True)
+            self.determine_imaging(pt)
+            self.determine_therapy(pt)
+            clinic_backlog.append(pt)
+
+        # fill imaging queue, deciding if needs hand therapy
+        for i in range(self.fill_imaging_q):
+            self.patient_counter += 1
+            pt = Patient(self.patient_counter, already_seen_clinic=True,
+                         needs_imaging=True, from_prefills=True)
+            self.determine_therapy(pt)
+            imaging_backlog.append(pt)
+
+        # fill therapy queue
+        for i in range(self.fill_therapy_q):
+            self.patient_counter += 1
+            pt = Patient(self.patient_counter, already_seen_clinic=True,
+                         already_seen_imaging=True, needs_therapy=True,
+                         from_prefills=True)
+            therapy_backlog.append(pt)
+
+        # fill theatre queue
+        for i in range(self.fill_theatre_q):
+            self.patient_counter += 1
+            pt = Patient(self.patient_counter, already_seen_clinic=True,
+                         already_seen_imaging=True, already_seen_therapy=True,
+                         from_prefills=True)
+            theatre_backlog.append(pt)
+
+        return clinic_backlog, imaging_backlog, therapy_backlog, theatre_backlog
+
+    # method to pre fill queues with set numbers in one step - each stage's
+    # prefilled patients wait in a deque served in FIFO order by a single
+    # process, and only become a process of their own once past that stage
+    def prefill_queues_bulk(self):
+
+        clinic_backlog, imaging_backlog, therapy_backlog, theatre_backlog = \
+            self.create_prefill_patients()
+
+        # add all prefilled patients to the trackers at once
+        self.active_entities += self.total_fill_queues
+        self.clinic_q += self.fill_clinic_q
+        self.imaging_q += self.fill_imaging_q
+        self.therapy_q += self.fill_therapy_q
+        self.theatre_q += self.fill_theatre_q
+
+        # start one process per stage to serve its backlog
+        for resource, backlog, duration, queue in [
+                (self.surg_clinic, clinic_backlog, self.surg_clinic_duration, 'clinic_q'),
+                (self.imaging, imaging_backlog, self.imaging_interval, 'imaging_q'),
+                (self.therapy, therapy_backlog, self.therapy_interval, 'therapy_q'),
+                (self.theatres, theatre_backlog, self.theatre_case_duration, 'theatre_q')]:
+            if backlog:
+                self.env.process(self.serve_backlog(resource, backlog, duration, queue))
+
+    # method to serve a stage's prefilled backlog in FIFO order - restored
+    # from a snapshot, the first patient may already be in their appointment,
+    # with remaining days of it left
+    def serve_backlog(self, resource, backlog, duration, queue, remaining=None):
+
+        if isinstance(resource, simpy.PriorityResource):
+            # request one patient at a time, at a priority between the
+            # unavailability processes (-1) and referred patients (0), so the
+            # backlog stays at the front of the queue but clinics and lists
+            # still close between sessions
+            while backlog:
+                pt = backlog.popleft()
+                with resource.request(priority=-0.5) as req:
+                    if remaining is None:
+                        yield req
+                        setattr(self, queue, getattr(self, queue) - 1)
+                        appointment = duration
+                        if self.calendars is not None:
+                            wait, appointment = self.calendars[queue].book(self.env.now)
+                        yield self.env.timeout(appointment)
+                    else:
+                        # restored first, so the resource was free and is
+                        # already held
+                        yield self.env.timeout(remaining)
+                        remaining = None
+
+                    if resource is self.theatres:
+                        self.discharge(pt)
+
+                if resource is self.surg_clinic:
+                    pt.already_seen_clinic = True
+                    self.env.process(self.enter_pathway(pt))
+
+        else:
+            # nothing else is ever ahead of the backlog at imaging or therapy,
+            # so hold the resource until the backlog is empty
+            with resource.request() as req:
+                if remaining is None:
+                    yield req
+                while backlog:
+                    pt = backlog.popleft()
+                    if remaining is None:
+                        setattr(self, queue, getattr(self, queue) - 1)
+                        appointment = duration
+                        if self.calendars is not None:
+                            wait, appointment = self.calendars[queue].book(self.env.now)
+                        yield self.env.timeout(appointment)
+                    else:
+                        yield self.env.timeout(remaining)
+                        remaining = None
+
+                    if resource is self.imaging:
+                        pt.already_seen_imaging = True
+                    else:
+                        pt.already_seen_therapy = True
+                    self.env.process(self.enter_pathway(pt))
+
+    #method to generate patient referrals - restored from a snapshot, the
+    #next referral is delay days away
+    def generate_referrals(self, delay=None):
+
+        if delay is not None:
+            yield self.env.timeout(delay)
         
-        #keep generating indefinitely (until simulation ends)
-        while True:
+        #keep generating until the end of simulation event has fired - after
+        #sim_duration, patients only count towards the final queue numbers
+        while not self.end_of_sim.triggered:
             
             #increment patient counter by 1
             self.patient_counter += 1
@@ -234,13 +431,24 @@ class Hand_Surgery_Pathway:
             #if before end sim, increment counter
             if pt.before_end_sim == True:
                 self.active_entities += 1
+
+            #record time of referral, and keep track of the patient if
+            #stopping at sim_duration
+            pt.time_entered_pathway = self.env.now
+            if self.in_pathway is not None:
+                self.in_pathway[pt.id] = pt
                 
             #get simpy env to run enter_pathway method with this patient
             self.env.process(self.enter_pathway(pt))
             #print(f'Patient {pt.id} has been generated and entered the clinic queue')
 
-            #randomly sample time to next referral
-            sampled_interref_time = random.expovariate(1.0/self.referral_interval)
+            #randomly sample time to next referral, at the rate in effect
+            #now if it changes with a schedule
+            if self.compiled_schedule is None:
+                sampled_interref_time = self.arrival_rng.expovariate(1.0/self.referral_interval)
+            else:
+                sampled_interref_time = self.compiled_schedule.referral_delay(
+                    self.env.now, self.arrival_rng)
             
             #freeze until time has elapsed
             yield self.env.timeout(sampled_interref_time)
@@ -258,15 +466,20 @@ class Hand_Surgery_Pathway:
             with self.surg_clinic.request() as req:
                 yield req
 
-                # record end of queue time and add to tracker
+                # record end of queue time and add to tracker - with a
+                # schedule, the patient is booked into the next clinic
                 end_q_clinic = self.env.now
                 self.clinic_q -= 1
+                appointment = self.surg_clinic_duration
+                if self.calendars is not None:
+                    wait, appointment = self.calendars['clinic_q'].book(end_q_clinic)
+                    end_q_clinic += wait
 
                 # record total queue time
                 patient.clinic_q_time = end_q_clinic - start_q_clinic
 
                 # freeze for clinic appointment duration
-                yield self.env.timeout(self.surg_clinic_duration)
+                yield self.env.timeout(appointment)
                 #print(f'Patient {patient.id} has left the clinic queue')
 
 
@@ -280,7 +493,10 @@ class Hand_Surgery_Pathway:
                 with self.imaging.request() as req:
                     yield req
                     self.imaging_q -= 1
-                    yield self.env.timeout(self.imaging_interval)
+                    appointment = self.imaging_interval
+                    if self.calendars is not None:
+                        wait, appointment = self.calendars['imaging_q'].book(self.env.now)
+                    yield self.env.timeout(appointment)
 
         # if needs therapy, timeout for therapy wait time
         if not patient.already_seen_therapy:
@@ -290,7 +506,10 @@ class Hand_Surgery_Pathway:
                 with self.therapy.request() as req:
                     yield req
                     self.therapy_q -= 1
-                    yield self.env.timeout(self.therapy_interval)
+                    appointment = self.therapy_interval
+                    if self.calendars is not None:
+                        wait, appointment = self.calendars['therapy_q'].book(self.env.now)
+                    yield self.env.timeout(appointment)
 
         # enter queue for theatres
         # record start of queue time and add to tracker
@@ -301,112 +520,270 @@ class Hand_Surgery_Pathway:
         with self.theatres.request() as req:
             yield req
 
-            # record end of queue time and add to tracker
+            # record end of queue time and add to tracker - with a
+            # schedule, the patient is booked onto the next list
             end_q_theatres = self.env.now
             self.theatre_q -= 1
+            appointment = self.theatre_case_duration
+            if self.calendars is not None:
+                wait, appointment = self.calendars['theatre_q'].book(end_q_theatres)
+                end_q_theatres += wait
 
             # record theatre queue time and overall queue time
             if not patient.from_prefills:
                 patient.theatre_q_time = end_q_theatres - start_q_theatres
-                patient.overall_q_time = end_q_theatres - start_q_clinic
-                patient.time_entered_pathway = start_q_clinic
+                patient.overall_q_time = end_q_theatres - patient.time_entered_pathway
 
             # freeze for theatre case duration
-            yield self.env.timeout(self.theatre_case_duration)
-            
-            # decrement counter if before end sim patient
-            if patient.before_end_sim == True:
-                self.active_entities -= 1
+            yield self.env.timeout(appointment)
+
+            self.discharge(patient)
+
+    # method to carry on a patient's way through the pathway from a snapshot,
+    # at the stage with queue counter stage - waiting there since
+    # queued_since, or in their appointment with remaining days of it left -
+    # then on through the stages they still need
+    def resume_pathway(self, patient, stage, queued_since, remaining=None):
+        resource, duration = self.stage_services()[stage]
 
-        # add patient to queue times dataframe
+        with resource.request() as req:
+            # patients in an appointment are restored first, so the resource
+            # was free and is already held
+            if remaining is None:
+                yield req
+                setattr(self, stage, getattr(self, stage) - 1)
+                start, remaining = self.env.now, duration
+                if self.calendars is not None:
+                    wait, remaining = self.calendars[stage].book(start)
+                    start += wait
+                if stage == 'clinic_q':
+                    patient.clinic_q_time = start - queued_since
+                elif stage == 'theatre_q' and not patient.from_prefills:
+                    patient.theatre_q_time = start - queued_since
+                    patient.overall_q_time = start - patient.time_entered_pathway
+
+            yield self.env.timeout(remaining)
+
+            if stage == 'theatre_q':
+                self.discharge(patient)
+                return
+
+        # mark the stages passed so enter_pathway skips them
+        patient.already_seen_clinic = True
+        if stage != 'clinic_q':
+            patient.already_seen_imaging = True
+        if stage == 'therapy_q':
+            patient.already_seen_therapy = True
+        yield from self.enter_pathway(patient)
+
+    # method to discharge a patient at the end of their theatre case
+    def discharge(self, patient):
+
+        # decrement counter if before end sim patient
+        if patient.before_end_sim == True:
+            self.active_entities -= 1
+            self.check_end_of_sim()
+
+        # add patient to queue times recorder
         if not patient.from_prefills and patient.before_end_sim == True:
             self.store_queue_times(patient)
+            if self.in_pathway is not None:
+                del self.in_pathway[patient.id]
 
-    # method to model interval between clinic appointments
-    def clinic_unavail(self):
+    # method to model interval between clinic appointments - restored from a
+    # snapshot, the clinic is open for open_for more days, or if closed_for
+    # is given is closed for that many more days
+    def clinic_unavail(self, open_for=1, closed_for=None):
 
         while True:
         
             #freeze clinic_unavail function for duration of clinic
-            yield self.env.timeout(1)
+            if closed_for is None:
+                yield self.env.timeout(open_for)
             
             #request clinic with max priority and hold until next clinic
             with self.surg_clinic.request(priority=-1) as req:
                 # Freeze the function until the request can be met (this
-                # ensures that the last patient in clinic will be seen)
-                yield req
+                # ensures that the last patient in clinic will be seen) -
+                # restored while closed, it was free so is already held
+                if closed_for is None:
+                    yield req
+                    closed_for = self.surg_clinic_interval
+
+                yield self.env.timeout(closed_for)
 
-                yield self.env.timeout(self.surg_clinic_interval)
+            open_for, closed_for = 1, None
 
-    # method to model interval between theatre lists
-    def theatres_unavail(self):
+    # method to model interval between theatre lists - open_for and
+    # closed_for as in clinic_unavail
+    def theatres_unavail(self, open_for=1, closed_for=None):
 
         while True:
         
             #freeze theatres_unavail function for duration of list
-            yield self.env.timeout(1)
+            if closed_for is None:
+                yield self.env.timeout(open_for)
             
             #request resource with max priority and hold until next list
             with self.theatres.request(priority=-1) as req:
                 # Freeze the function until the request can be met (this
-                # ensures that the last theatre case will be completed)
-                yield req
-                
-                yield self.env.timeout(self.theatre_list_interval)
-
-    # method to check if simulation should continue
-    def monitor(self, env, active_entities, end_point, end_of_sim):
-        while True:
-            # check conditions every 1 time unit
-            yield self.env.timeout(1)
-            if self.env.now >= self.sim_duration and self.active_entities <= 0:
-                # trigger end of simulation event
-                self.end_of_sim.succeed()
-                break
-            #else:
-                #print(self.active_entities)
+                # ensures that the last theatre case will be completed) -
+                # restored while closed, it was free so is already held
+                if closed_for is None:
+                    yield req
+                    closed_for = self.theatre_list_interval
+
+                yield self.env.timeout(closed_for)
+
+            open_for, closed_for = 1, None
+
+    # method to end the simulation once sim_duration has passed and every
+    # patient referred before then has been through theatres
+    def check_end_of_sim(self):
+        if (self.env.now >= self.sim_duration and self.active_entities <= 0
+                and not self.end_of_sim.triggered):
+            # trigger end of simulation event
+            self.end_of_sim.succeed()
+
+    # method to check for the end of simulation at sim_duration, in case
+    # every patient has already been through theatres by then - restored
+    # from a snapshot, sim_duration is delay days away
+    def end_of_horizon(self, delay=None):
+        yield self.env.timeout(self.sim_duration if delay is None else delay)
+        self.check_end_of_sim()
+
+    # method to sample the numbers in each queue at fixed intervals up to
+    # sim_duration - one event per sample, whatever the number of patients.
+    # Restored from a snapshot, the next sample is delay days away
+    def sample_queue_lengths(self, delay=None):
+        recorder = self.queue_lengths
+        while recorder.next_time() <= self.sim_duration:
+            if delay is None:
+                delay = recorder.next_time() - self.env.now
+            yield self.env.timeout(delay)
+            delay = None
+            recorder.record(self.env.now, self.clinic_q, self.imaging_q,
+                            self.therapy_q, self.theatre_q)
+
+    # method to return the sample interval and sample times of queue
+    # lengths, for models that work them out after the run
+    def queue_sample_times(self):
+        interval = Queue_Length_Recorder.fitted_interval(
+            self.queue_sample_interval, g.queue_max_samples, self.sim_duration)
+        times = [i * interval for i in range(int(self.sim_duration / interval) + 1)]
+        return interval, times
 
     #method to store queue times
     def store_queue_times(self, patient):
 
-        # create temporary dataframe with queue times
-        df_to_add = pd.DataFrame({'time_entered_pathway': [patient.time_entered_pathway],
-                                  'overall_q_time': [patient.overall_q_time]})
+        # add to recorder - converted to a dataframe once at end of run
+        self.recorder.record(patient)
 
-        # add to main dataframe
-        self.q_times_df = pd.concat([self.q_times_df, df_to_add])
+    # A method to return the numbers in each queue
+    def queue_numbers(self):
+        return [self.clinic_q, self.imaging_q, self.therapy_q, self.theatre_q]
 
-    # A method to save the wait times from this run to a csv file
-    def write_queue_times(self):
-        print(self.q_times_df.head())
-        self.q_times_df.to_csv(f'wait_times_run_{self.run_number}.csv')
+    # A method to start the simulation processes
+    def start(self):
+        self.started = True
 
-    # A method to write the queue numbers to a csv file
-    def write_queue_numbers(self):
-        with open('queue_numbers.csv', 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=',')
-            writer.writerow([self.run_number, self.clinic_q, self.imaging_q,
-                             self.therapy_q, self.theatre_q])
-            
-    # A method to run the simulation
-    def run(self):
         # fill queues
-        self.env.process(self.prefill_queues())
+        if self.bulk_prefill:
+            self.prefill_queues_bulk()
+        else:
+            self.env.process(self.prefill_queues())
 
         # start entity generators
         self.env.process(self.generate_referrals())
 
-        #simulate interval between clinics and lists
-        self.env.process(self.clinic_unavail())
-        self.env.process(self.theatres_unavail())
-
-        #use monitor() to check if sim should end
-        self.env.process(self.monitor(self.env, self.active_entities,
-                                      self.sim_duration, self.end_of_sim))
-
-        #run simulation
-        self.env.run(until=self.end_of_sim)
-
-        #write results to csv
-        self.write_queue_times()
-        self.write_queue_numbers()
\ No newline at end of file
+        #simulate interval between clinics and lists, unless booking
+        #patients into sessions compiled from a schedule
+        if self.calendars is None:
+            self.env.process(self.clinic_unavail())
+            self.env.process(self.theatres_unavail())
+
+        #end the sim when the last patient referred before sim_duration
+        #leaves theatres, checking at sim_duration itself in case all have
+        self.env.process(self.end_of_horizon())
+
+        #sample numbers in queues through the simulation
+        if self.queue_lengths is not None:
+            self.env.process(self.sample_queue_lengths())
+
+    # A method to record the patients still in the pathway at sim_duration.
+    # Patients in theatre have finished waiting, so are recorded as usual -
+    # the rest have waited since referral and are returned as censored
+    def record_in_pathway(self):
+        entered, waited = [], []
+        for patient in self.in_pathway.values():
+            # overall_q_time is set when theatre starts (or the patient is
+            # booked onto a list, with a schedule), and always includes a
+            # clinic appointment so is never zero once set
+            start = patient.time_entered_pathway + patient.overall_q_time
+            if patient.overall_q_time > 0 and start < self.sim_duration:
+                self.store_queue_times(patient)
+            else:
+                entered.append(patient.time_entered_pathway)
+                waited.append(self.sim_duration - patient.time_entered_pathway)
+        self.in_pathway.clear()
+
+        unknown = [float('nan')] * len(entered)
+        return Wait_Time_Recorder.from_columns(
+            time_entered_pathway=entered, overall_q_time=waited,
+            clinic_q_time=unknown, theatre_q_time=unknown)
+
+    # A method to return the results of this run
+    def results(self):
+        censored_waits = None
+        if self.stop_at_horizon:
+            censored_waits = self.record_in_pathway()
+        return Run_Results(self.run_number, self.recorder, *self.queue_numbers(),
+                           queue_lengths=self.queue_lengths,
+                           censored_waits=censored_waits)
+
+    # A method to check whether the run has ended
+    def finished(self):
+        if self.stop_at_horizon:
+            return self.env.now >= self.sim_duration
+        return self.end_of_sim.triggered
+
+    # A method to run the simulation up to time, starting it if need be, or
+    # until it ends if sooner - e.g. to take a Checkpoint.Pathway_Snapshot
+    # there. Events at time itself are left to be processed
+    def run_until(self, time):
+        if not self.started:
+            self.start()
+        if self.stop_at_horizon:
+            time = min(time, self.sim_duration)
+
+        # stop early if every patient is through theatres first
+        callbacks = self.end_of_sim.callbacks
+        if callbacks is not None and StopSimulation.callback not in callbacks:
+            callbacks.append(StopSimulation.callback)
+
+        if time > self.env.now and not self.finished():
+            self.env.run(until=time)
+
+    # A method to run the simulation to its end from wherever it has got to,
+    # starting it if need be, and return the results of this run
+    def finish(self):
+        if not self.started:
+            self.start()
+
+        #run simulation, to sim_duration or until every patient referred
+        #before then has been through theatres
+        if not self.stop_at_horizon:
+            self.env.run(until=self.end_of_sim)
+        elif self.env.now < self.sim_duration:
+            self.env.run(until=self.sim_duration)
+
+        #return results of this run
+        return self.results()
+
+    # A method to run the simulation - with a RunProfiler.Run_Profiler, the
+    # run is measured and its report kept in the profiler
+    def run(self, profiler=None):
+        if profiler is not None:
+            return profiler.run(self, self.results)
+
+        return self.finish()
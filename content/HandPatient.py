@@ -1,32 +1,37 @@
 # A class representing patients referred to the GSTT hand surgery pathway
 
-import random
-
 class Patient:
+
+    # fixed attributes instead of a per-patient __dict__, so large backlogs
+    # of waiting patients take less memory and attribute access is faster
+    __slots__ = ('id', 'needs_imaging', 'needs_therapy',
+                 'time_entered_pathway',
+                 'clinic_q_time', 'theatre_q_time', 'overall_q_time',
+                 'already_seen_clinic', 'already_seen_imaging', 'already_seen_therapy',
+                 'before_end_sim', 'from_prefills')
+
     def __init__(self, p_id, already_seen_clinic=False,
                  already_seen_imaging=False, already_seen_therapy=False,
                  needs_imaging=False, needs_therapy=False,
                  before_end_sim=True, from_prefills=False):
-        
+
         self.id = p_id
-        self.needs_imaging = False
-        self.needs_therapy = False
+        self.needs_imaging = needs_imaging
+        self.needs_therapy = needs_therapy
 
         self.time_entered_pathway = 0
-        
+
         self.clinic_q_time = 0
         self.theatre_q_time = 0
         self.overall_q_time = 0
 
         #attributes to help with pre filling queues
-        self.already_seen_clinic = False
-        self.already_seen_imaging = False
-        self.already_seen_therapy = False
+        self.already_seen_clinic = already_seen_clinic
+        self.already_seen_imaging = already_seen_imaging
+        self.already_seen_therapy = already_seen_therapy
 
         #attribute for before/after end of sim
-        self.before_end_sim = True
+        self.before_end_sim = before_end_sim
 
         #attribute for patients who are pre-filled into queues
-        self.from_prefills = False
-
-
+        self.from_prefills = from_prefills
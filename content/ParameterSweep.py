@@ -0,0 +1,145 @@
+# A class to run the simulation over a grid or sample of parameters
+
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ResultsCache import cache_key
+from TrialRunner import run_replication, spawn_seeds, engines
+from global_params import g
+
+
+# function to list every combination of a grid of parameter values,
+# e.g. {'theatre_list_per_week': [2, 3], 'theatre_list_capacity': [5, 6]}
+def parameter_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+# function to sample parameters by Latin hypercube from (low, high) ranges,
+# e.g. {'trauma_extra_patients': (0, 4)} - parameters with integer bounds
+# are rounded to integers
+def latin_hypercube(ranges, samples, seed=None):
+    rng = random.Random(seed)
+    columns = {}
+    for name, (low, high) in ranges.items():
+        # one value from each of samples equal strata, in random order
+        strata = list(range(samples))
+        rng.shuffle(strata)
+        values = [low + (stratum + rng.random()) / samples * (high - low)
+                  for stratum in strata]
+        if isinstance(low, int) and isinstance(high, int):
+            values = [round(value) for value in values]
+        columns[name] = values
+    return [{name: columns[name][i] for name in ranges} for i in range(samples)]
+
+
+# function to run one replication of one scenario and summarise it as a row
+# of the results table - defined at module level for worker processes
+def run_sweep_unit(key, run_number, seed, params, engine, sim_duration):
+    results = run_replication(run_number, seed, params, engine)
+    return {'scenario': key, 'run': run_number,
+            'clinic_q': results.clinic_q, 'imaging_q': results.imaging_q,
+            'therapy_q': results.therapy_q, 'theatres_q': results.theatre_q,
+            **results.summary(sim_duration)}
+
+
+class Parameter_Sweep:
+    def __init__(self,
+                 number_of_runs = g.number_of_runs,
+                 master_seed = g.master_seed,
+                 max_workers = None,
+                 engine = g.engine,
+                 cache = None,
+                 **base_params):
+
+        # base_params are passed to Hand_Surgery_Pathway for every
+        # scenario, updated with the scenario's own parameters
+        if engine not in engines:
+            raise ValueError(f'Parameter sweeps run one replication at a time - '
+                             f'use one of {", ".join(engines)}')
+
+        self.number_of_runs = number_of_runs
+        self.master_seed = master_seed
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.engine = engine
+        self.base_params = base_params
+
+        # every scenario uses the same seed for a given run number
+        self.seeds = spawn_seeds(master_seed, number_of_runs)
+
+        # rows of completed scenarios, by scenario key - in memory unless a
+        # Results_Cache is given to keep them between sessions
+        self.cache = {} if cache is None else cache
+
+    # method to return a scenario's full parameters and key
+    def scenario(self, params):
+        full_params = {**self.base_params, **params}
+        return full_params, cache_key(full_params, self.number_of_runs,
+                                      self.master_seed, self.engine, kind='sweep')
+
+    # method to yield a results row per scenario and replication as each
+    # completes, running only scenarios not already in the cache. A
+    # scenario given more than once has its rows yielded once
+    def iter_results(self, scenarios):
+        pending = {}
+        seen = set()
+        for params in scenarios:
+            full_params, key = self.scenario(params)
+            if key in seen:
+                continue
+            seen.add(key)
+            cached_rows = self.cache.get(key)
+            if cached_rows is not None:
+                yield from cached_rows
+            else:
+                pending[key] = full_params
+
+        units = [(key, run_number, seed, full_params, self.engine,
+                  full_params.get('sim_duration', g.sim_duration))
+                 for key, full_params in pending.items()
+                 for run_number, seed in enumerate(self.seeds)]
+        rows = {key: [] for key in pending}
+
+        def complete(row):
+            # add the row, caching the scenario once all its runs are done
+            rows[row['scenario']].append(row)
+            if len(rows[row['scenario']]) == self.number_of_runs:
+                self.cache[row['scenario']] = sorted(rows[row['scenario']],
+                                                     key=lambda r: r['run'])
+
+        if self.max_workers == 1:
+            for unit in units:
+                row = run_sweep_unit(*unit)
+                complete(row)
+                yield row
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(run_sweep_unit, *unit) for unit in units]
+                for future in as_completed(futures):
+                    row = future.result()
+                    complete(row)
+                    yield row
+
+    # method to run scenarios - a list of parameter dicts - returning a
+    # tidy table with one row per scenario and replication
+    def run(self, scenarios):
+        import pandas as pd
+
+        scenarios = list(scenarios)
+        params = {self.scenario(p)[1]: p for p in scenarios}
+        rows = [{**params[row['scenario']], **row}
+                for row in self.iter_results(scenarios)]
+
+        table = pd.DataFrame(rows)
+        return table.sort_values(['scenario', 'run'], ignore_index=True)
+
+    # method to run every combination of a grid of parameter values
+    def run_grid(self, grid):
+        return self.run(parameter_grid(grid))
+
+    # method to run Latin hypercube samples from ranges of parameter values
+    def run_latin_hypercube(self, ranges, samples, seed=None):
+        return self.run(latin_hypercube(ranges, samples, seed))
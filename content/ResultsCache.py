@@ -0,0 +1,164 @@
+# A class to store simulation results on disk, keyed by everything that
+# determines them, so repeated scenarios do not need to be run again
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from HandPathway import Hand_Surgery_Pathway
+from global_params import g
+
+
+# modules whose code determines simulation results - a change to any of
+# them gives new cache keys
+simulation_modules = ['HandPatient.py', 'HandPathway.py', 'SlotPathway.py',
+                      'BatchPathway.py', 'ResultsRecorder.py', 'TrialRunner.py',
+                      'Schedule.py', 'global_params.py']
+
+_code_version = None
+
+
+# function to return a hash of the simulation source code
+def code_version():
+    global _code_version
+    if _code_version is None:
+        sha = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for module in simulation_modules:
+            with open(os.path.join(directory, module), 'rb') as f:
+                sha.update(f.read())
+        _code_version = sha.hexdigest()[:16]
+    return _code_version
+
+
+# function to fill in the Hand_Surgery_Pathway defaults for any parameters
+# not given, so a default passed explicitly gives the same key as omitting it
+def full_parameters(params):
+    signature = inspect.signature(Hand_Surgery_Pathway.__init__)
+    defaults = {name: parameter.default
+                for name, parameter in signature.parameters.items()
+                if parameter.default is not inspect.Parameter.empty
+                and name != 'seed'}
+    return {**defaults, **params}
+
+
+# function to create the key of a set of results from the parameters, seed,
+# number of runs, engine and code version. kind separates different
+# summaries of the same runs, e.g. 'trial' for Run_Results lists
+def cache_key(params, number_of_runs, master_seed, engine, kind='trial'):
+    scenario = {'params': full_parameters(params), 'number_of_runs': number_of_runs,
+                'master_seed': master_seed, 'engine': engine, 'kind': kind,
+                'code_version': code_version()}
+    text = json.dumps(scenario, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Results_Cache:
+    def __init__(self, path = g.results_cache_path,
+                 max_megabytes = g.results_cache_max_megabytes):
+
+        # results are pickled into a SQLite table, with the least recently
+        # used removed once the total is over max_megabytes
+        self.path = path
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+
+        # hits and misses of this instance - totals across sessions are
+        # kept in the database
+        self.hits = 0
+        self.misses = 0
+
+        # write-ahead logging lets sessions in other threads and server
+        # processes read while one writes - the setting is kept in the file
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+        finally:
+            db.close()
+
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS results '
+                       '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS counters '
+                       '(name TEXT PRIMARY KEY, count INTEGER)')
+            db.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    # method to open a connection that commits and closes when done - one
+    # per operation, so a cache can be shared by threads and processes,
+    # each waiting up to 30 seconds for another's write to finish
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    # method to return the results stored under key, or default if missing
+    def get(self, key, default=None):
+        with self.connect() as db:
+            row = db.execute('SELECT value FROM results WHERE key = ?',
+                             (key,)).fetchone()
+            counter = 'hits' if row is not None else 'misses'
+            db.execute('UPDATE counters SET count = count + 1 WHERE name = ?',
+                       (counter,))
+            if row is not None:
+                db.execute('UPDATE results SET last_used = ? WHERE key = ?',
+                           (time.time(), key))
+
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    # method to store results under key, then evict the least recently used
+    # results while the cache is over its size limit
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.connect() as db:
+            db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                       (key, blob, len(blob), time.time()))
+            db.execute('DELETE FROM results WHERE key IN ('
+                       'SELECT key FROM (SELECT key, SUM(size) OVER '
+                       '(ORDER BY last_used DESC, key) AS total FROM results) '
+                       'WHERE total > ?)', (self.max_bytes,))
+
+    # methods so a cache can be used like a dict of results
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    # method to return the stored results, or run function and store them
+    def get_or_run(self, key, function, *args):
+        value = self.get(key)
+        if value is None:
+            value = function(*args)
+            self.put(key, value)
+        return value
+
+    # method to return hit and miss counts, this session and in total, and
+    # the number and size of stored results
+    def stats(self):
+        with self.connect() as db:
+            totals = dict(db.execute('SELECT name, count FROM counters'))
+            entries, size = db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'total_hits': totals['hits'], 'total_misses': totals['misses'],
+                'entries': entries, 'megabytes': size / 1024 / 1024}
+
+    # method to remove every stored result
+    def clear(self):
+        with self.connect() as db:
+            db.execute('DELETE FROM results')
@@ -1,19 +1,75 @@
 # A class to calculate and display trial results
 
-import simpy
-import random
-import numpy as np
-import pandas as pd
-import csv
-from statistics import mean
-import matplotlib.pyplot as plt
-import seaborn as sns
+# pandas and plotly are imported in the methods that use them, so runs can
+# be added and summarised without loading them
+
+import importlib.util
+import io
 import os
-import plotly.express as px
+import time
 
 from global_params import g
-from HandPathway import Hand_Surgery_Pathway
-from HandPatient import Patient
+from ResultsRecorder import Wait_Time_Recorder, Run_Results
+from RunningStats import Running_Stats
+
+
+# function to write a dataframe to a parquet, arrow or csv file - path can
+# also be a file-like buffer, with the format given by extension
+def write_table(df, path, extension=None):
+    if extension is None:
+        extension = os.path.splitext(path)[1]
+    extension = extension.lower()
+    if extension == '.parquet':
+        df.to_parquet(path, index=False)
+    elif extension in ('.arrow', '.feather'):
+        df.reset_index(drop=True).to_feather(path)
+    elif extension == '.csv':
+        df.to_csv(path, index=False)
+    else:
+        raise ValueError(f'Unsupported export format {extension!r} - '
+                         'use .parquet, .arrow, .feather or .csv')
+
+
+# function to return the extension to export in by default - parquet needs
+# pyarrow, so csv if it is not installed
+def default_extension():
+    return '.parquet' if importlib.util.find_spec('pyarrow') is not None else '.csv'
+
+
+# function to return a dataframe as the bytes of a parquet, arrow or csv
+# file, e.g. for a download, without writing to disk
+def table_bytes(df, extension='.parquet'):
+    buffer = io.BytesIO()
+    write_table(df, buffer, extension)
+    return buffer.getvalue()
+
+
+# function to calculate the Kaplan-Meier estimate of the probability a
+# patient is still waiting after each wait time, from waits that ended
+# (observed) and waits still going when the run stopped (censored)
+def kaplan_meier(observed, censored):
+    import numpy as np
+    import pandas as pd
+
+    waits = np.concatenate([np.asarray(observed, dtype=float),
+                            np.asarray(censored, dtype=float)])
+    ended = np.concatenate([np.ones(len(observed)), np.zeros(len(censored))])
+
+    times, slots = np.unique(waits, return_inverse=True)
+    events = np.bincount(slots, weights=ended)
+    leaving = np.bincount(slots)
+    at_risk = len(waits) - np.concatenate([[0], np.cumsum(leaving)[:-1]])
+
+    # censored waits are still waiting at a time, so only leave the
+    # patients at risk after it
+    df = pd.DataFrame({'wait': times, 'at_risk': at_risk, 'ended': events,
+                       'censored': leaving - events,
+                       'still_waiting': np.cumprod(1 - events / at_risk)})
+    return df[df['ended'] > 0].reset_index(drop=True) if len(df) else df
+
+
+# measures whose confidence intervals add_runs_until_precise narrows
+precision_measures = ['total_q', 'wait_time_start', 'wait_time_end']
 
 
 class Trial_Results_Calculator:
@@ -23,7 +79,8 @@ class Trial_Results_Calculator:
                  fill_clinic_q = g.fill_clinic_q,
                  fill_imaging_q = g.fill_imaging_q,
                  fill_therapy_q = g.fill_therapy_q,
-                 fill_theatre_q = g.fill_theatre_q):
+                 fill_theatre_q = g.fill_theatre_q,
+                 summary_mode = False):
         #self.trial_results_df = pd.DataFrame()
 
         self.number_of_runs = number_of_runs
@@ -33,52 +90,359 @@ class Trial_Results_Calculator:
         self.fill_therapy_q = fill_therapy_q
         self.fill_theatre_q = fill_theatre_q
 
-    # A method to concatenate the multiple wait time CSVs
+        # Run_Results returned by each run of Hand_Surgery_Pathway
+        self.run_results = []
+
+        # running statistics of each run's summary, so estimates can be
+        # shown as runs complete
+        self.running_stats = {measure: Running_Stats() for measure in
+                              ['clinic_q', 'imaging_q', 'therapy_q', 'theatres_q',
+                               'total_q', 'wait_time_start', 'wait_time_end']}
+
+        # summary of each run by run number, to pair runs with another
+        # scenario's
+        self.run_summaries = {}
+
+        # why add_runs_until_precise stopped - 'precision', 'max_runs' or 'time'
+        self.stopping_reason = None
+
+        # bytes of the last export_results_bytes, by name, extension and
+        # number of runs
+        self.exported_bytes = {}
+
+        # in summary mode, wait times are added to sketches as each run
+        # completes and not kept, so memory does not grow with the runs
+        self.summary_mode = summary_mode
+        self.wait_time_summary = None
+        if summary_mode:
+            from WaitTimeSketches import Wait_Time_Summary
+            self.wait_time_summary = Wait_Time_Summary()
+
+        # waits of all patients referred on the first and last days, kept
+        # exactly in summary mode as the sketches cover buckets of days
+        self.start_waits = Running_Stats()
+        self.end_waits = Running_Stats()
+
+    # A method to add the results of one run as it completes
+    def add_run_result(self, results):
+        summary = results.summary(self.sim_duration)
+        summary.update(results.queue_numbers_row())
+        for measure, stats in self.running_stats.items():
+            stats.add(summary[measure])
+        self.run_summaries[results.run_number] = summary
+
+        # in summary mode, keep the run without its wait times
+        if self.summary_mode:
+            self.wait_time_summary.add_recorder(results.wait_times)
+            last_day = self.sim_duration - 1
+            for day, wait in zip(results.wait_times.time_entered_pathway,
+                                 results.wait_times.overall_q_time):
+                if day < 1:
+                    self.start_waits.add(wait)
+                elif day > last_day:
+                    self.end_waits.add(wait)
+            results = Run_Results(results.run_number, Wait_Time_Recorder(),
+                                  results.clinic_q, results.imaging_q,
+                                  results.therapy_q, results.theatre_q,
+                                  queue_lengths=results.queue_lengths,
+                                  censored_waits=results.censored_waits)
+
+        self.run_results.append(results)
+
+    # A method to add the results of one or more runs
+    def add_run_results(self, run_results):
+        for results in run_results:
+            self.add_run_result(results)
+
+    # A method to return the running mean and confidence interval of the
+    # queue numbers and start/end wait times over the runs so far
+    def running_estimates(self, confidence=0.95):
+        import pandas as pd
+
+        rows = []
+        for measure, stats in self.running_stats.items():
+            half_width = stats.ci_half_width(confidence)
+            rows.append({'measure': measure, 'runs': stats.count, 'mean': stats.mean,
+                         'lower': stats.mean - half_width,
+                         'upper': stats.mean + half_width})
+        return pd.DataFrame(rows).set_index('measure')
+
+    # A method to estimate the difference in each measure between this
+    # scenario and a baseline scenario's calculator, from the differences
+    # between runs with the same run number. With common random numbers
+    # and the same seeds, paired runs see the same referrals, so the
+    # differences vary much less than the measures themselves and the
+    # confidence interval is narrower for the same number of runs
+    def paired_difference(self, baseline, confidence=0.95):
+        import pandas as pd
+
+        paired = sorted(self.run_summaries.keys() & baseline.run_summaries.keys())
+        rows = []
+        for measure in self.running_stats:
+            stats = Running_Stats()
+            for run_number in paired:
+                stats.add(self.run_summaries[run_number][measure] -
+                          baseline.run_summaries[run_number][measure])
+            half_width = stats.ci_half_width(confidence)
+            rows.append({'measure': measure, 'runs': stats.count,
+                         'difference': stats.mean,
+                         'lower': stats.mean - half_width,
+                         'upper': stats.mean + half_width})
+        return pd.DataFrame(rows).set_index('measure')
+
+    # A method to return the measures checked for precision that no run has
+    # a value for - with stop_at_horizon, e.g., no referral reaches theatre
+    # before sim_duration, so there are no start/end mean waits
+    def unmeasured_precision_measures(self):
+        return [measure for measure in precision_measures
+                if self.running_stats[measure].count == 0]
+
+    # A method to check whether the confidence intervals of the end of
+    # simulation total queue and start/end mean waits are all within
+    # relative_tolerance of their means, leaving out measures with no values
+    def is_precise(self, relative_tolerance, confidence=0.95):
+        unmeasured = self.unmeasured_precision_measures()
+        return all(self.running_stats[measure].relative_half_width(confidence)
+                   < relative_tolerance
+                   for measure in precision_measures if measure not in unmeasured)
+
+    # A method to add runs from trial_runner as they complete, yielding each
+    # run's results once it has been added
+    def add_runs(self, trial_runner):
+        runs = trial_runner.iter_runs()
+        try:
+            for results in runs:
+                self.add_run_result(results)
+                yield results
+        finally:
+            runs.close()
+
+    # A method to add runs from trial_runner as they complete until results
+    # are precise to relative_tolerance, or the runner's runs or max_seconds
+    # run out, yielding each run's results. Runs not yet started when it
+    # stops are cancelled, and the reason is kept in stopping_reason
+    def add_runs_until_precise(self, trial_runner,
+                               relative_tolerance = g.adaptive_tolerance,
+                               min_runs = g.adaptive_min_runs,
+                               max_seconds = g.adaptive_max_seconds,
+                               confidence = 0.95):
+        start = time.perf_counter()
+        self.stopping_reason = None
+        runs = trial_runner.iter_runs()
+        try:
+            for results in runs:
+                self.add_run_result(results)
+                yield results
+
+                if len(self.run_results) >= min_runs and \
+                        self.is_precise(relative_tolerance, confidence):
+                    self.stopping_reason = 'precision'
+                    break
+                if time.perf_counter() - start > max_seconds:
+                    self.stopping_reason = 'time'
+                    break
+            else:
+                self.stopping_reason = 'max_runs'
+        finally:
+            runs.close()
+
+    # A method to run until results are precise, as add_runs_until_precise,
+    # returning why it stopped
+    def run_until_precise(self, trial_runner, **kwargs):
+        for results in self.add_runs_until_precise(trial_runner, **kwargs):
+            pass
+        return self.stopping_reason
+
+    # A method to concatenate the wait times of all runs in memory
     def concatenate_wait_times(self):
+        import pandas as pd
+
+        self.all_wait_times_df = pd.concat(
+            [results.wait_times_df() for results in self.run_results],
+            ignore_index=True)
+
+        self.queue_numbers_df = pd.DataFrame(
+            [results.queue_numbers_row() for results in self.run_results])
+
+        # waits of patients still in the pathway when runs stopped at
+        # sim_duration, if any
+        censored = [results.censored_waits_df() for results in self.run_results
+                    if results.censored_waits is not None]
+        self.censored_waits_df = pd.concat(censored, ignore_index=True) \
+            if censored else None
 
-        # create empty dataframe
-        nodata = {'time_entered_pathway': [],
-                    'overall_q_time': []}
-        all_wait_times_df = pd.DataFrame(nodata)
-
-        for i in range(self.number_of_runs):
-            wait_times_this_run = pd.read_csv(f'wait_times_run_{i}.csv')
-            all_wait_times_df = pd.concat([all_wait_times_df, wait_times_this_run])
-
-        # save to csv
-        #print(all_wait_times_df.head())
-        all_wait_times_df.to_csv('all_wait_times.csv')
-
-        # delete individual run files
-        for i in range(self.number_of_runs):
-            os.remove(f'wait_times_run_{i}.csv')
-
-    # A method to read in the run results csv file and print them for the user
-    def plot_wait_times(self):
-        trial_results_df = pd.read_csv('all_wait_times.csv')
-        
-        fig = px.scatter(trial_results_df, x='time_entered_pathway',
-                            y='overall_q_time', opacity=0.6, trendline='ols',
-                            trendline_color_override='red',
-                            title='Total wait time vs time of referral',
-                            labels={'time_entered_pathway': 'Day of referral',
-                                    'overall_q_time': 'Total wait time'})
+        # queue length samples through each run, if recorded
+        queue_lengths = [results.queue_lengths_df() for results in self.run_results
+                         if results.queue_lengths is not None]
+        self.queue_lengths_df = pd.concat(queue_lengths, ignore_index=True) \
+            if queue_lengths else None
+
+    # A method to calculate the mean and percentile bands across runs of the
+    # numbers in each queue, and in total, at each sample time
+    def calculate_queue_length_bands(self, lower=10, upper=90):
+        import pandas as pd
+
+        df = self.queue_lengths_df.copy()
+        queues = ['clinic_q', 'imaging_q', 'therapy_q', 'theatre_q']
+        df['total_q'] = df[queues].sum(axis=1)
+
+        grouped = df.groupby('time')[queues + ['total_q']]
+        self.queue_length_bands_df = pd.concat(
+            {'mean': grouped.mean(),
+             f'p{lower}': grouped.quantile(lower / 100),
+             f'p{upper}': grouped.quantile(upper / 100)}, axis=1)
+        self.queue_length_band_names = (f'p{lower}', f'p{upper}')
+        return self.queue_length_bands_df
+
+    # A method to plot the mean numbers in each queue over time, with the
+    # percentile band of the total
+    def plot_queue_lengths(self):
+        import plotly.graph_objects as go
+
+        bands = self.queue_length_bands_df
+        lower, upper = self.queue_length_band_names
+        times = bands.index
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=times, y=bands[upper]['total_q'],
+                                 line={'width': 0}, showlegend=False,
+                                 hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=times, y=bands[lower]['total_q'],
+                                 line={'width': 0}, fill='tonexty',
+                                 fillcolor='rgba(99, 110, 250, 0.2)',
+                                 name=f'Total ({lower}-{upper}th percentile)'))
+        fig.add_trace(go.Scatter(x=times, y=bands['mean']['total_q'], name='Total'))
+        for queue, name in [('clinic_q', 'Clinic'), ('imaging_q', 'Imaging'),
+                            ('therapy_q', 'Hand Therapy'), ('theatre_q', 'Theatres')]:
+            fig.add_trace(go.Scatter(x=times, y=bands['mean'][queue], name=name))
+
+        fig.update_layout(title='Numbers in waiting lists during simulation',
+                          xaxis_title='Day', yaxis_title='Patients waiting')
         return fig
 
-    # method to calculate average queue numbers over all runs
-    def calculate_mean_queue_numbers(self):
+    # A method to summarise wait times in bins of referral day - the mean
+    # referral day, number of patients, and mean, median and percentile
+    # band of their waits in each bin, so plots stay the same size however
+    # many patients there are
+    def calculate_binned_wait_times(self, bins = g.wait_plot_bins, lower=10, upper=90):
+        import pandas as pd
+
+        df = self.all_wait_times_df
+        bin_days = max(self.sim_duration / bins, 1)
+        grouped = df.groupby((df['time_entered_pathway'] // bin_days).astype(int))
+        waits = grouped['overall_q_time']
+        self.binned_wait_times_df = pd.DataFrame({
+            'referral_day': grouped['time_entered_pathway'].mean(),
+            'patients': waits.size(),
+            'mean': waits.mean(),
+            'median': waits.median(),
+            f'p{lower}': waits.quantile(lower / 100),
+            f'p{upper}': waits.quantile(upper / 100)}).reset_index(drop=True)
+        self.binned_wait_band_names = (f'p{lower}', f'p{upper}')
+        return self.binned_wait_times_df
+
+    # A method to fit a straight line of wait time against day of referral
+    # to the binned means, weighted by the patients in each bin - the same
+    # fit as least squares on every patient, up to the spread within bins
+    def wait_time_trendline(self):
+        import numpy as np
+
+        binned = self.binned_wait_times_df
+        if len(binned) < 2:
+            return binned['referral_day'], binned['mean']
+        slope, intercept = np.polyfit(binned['referral_day'], binned['mean'], 1,
+                                      w=np.sqrt(binned['patients']))
+        return binned['referral_day'], intercept + slope * binned['referral_day']
+
+    # A method to plot the wait times of all runs - every patient, a sample
+    # of patients, or bins of referral day (see g.wait_plot_mode)
+    def plot_wait_times(self, mode = g.wait_plot_mode,
+                        max_points = g.wait_plot_max_points):
+        trial_results_df = self.all_wait_times_df
+        if mode == 'auto':
+            mode = 'scatter' if len(trial_results_df) <= max_points else 'binned'
+
+        if mode == 'scatter':
+            import plotly.express as px
+
+            fig = px.scatter(trial_results_df, x='time_entered_pathway',
+                                y='overall_q_time', opacity=0.6, trendline='ols',
+                                trendline_color_override='red',
+                                title='Total wait time vs time of referral',
+                                labels={'time_entered_pathway': 'Day of referral',
+                                        'overall_q_time': 'Total wait time'})
+            return fig
+
+        import plotly.graph_objects as go
+
+        self.calculate_binned_wait_times()
+        binned = self.binned_wait_times_df
+        fig = go.Figure()
+
+        if mode == 'sample':
+            # a uniform sample of patients, drawn with WebGL
+            sample = trial_results_df.sample(min(max_points, len(trial_results_df)),
+                                             random_state=0)
+            fig.add_trace(go.Scattergl(x=sample['time_entered_pathway'],
+                                       y=sample['overall_q_time'], mode='markers',
+                                       opacity=0.6, name=f'{len(sample)} patients'))
+        elif mode == 'binned':
+            lower, upper = self.binned_wait_band_names
+            fig.add_trace(go.Scatter(x=binned['referral_day'], y=binned[upper],
+                                     line={'width': 0}, showlegend=False,
+                                     hoverinfo='skip'))
+            fig.add_trace(go.Scatter(x=binned['referral_day'], y=binned[lower],
+                                     line={'width': 0}, fill='tonexty',
+                                     fillcolor='rgba(99, 110, 250, 0.2)',
+                                     name=f'{lower}-{upper}th percentile'))
+            fig.add_trace(go.Scatter(x=binned['referral_day'], y=binned['median'],
+                                     name='Median'))
+        else:
+            raise ValueError(f'Unknown wait time plot mode {mode!r} - '
+                             "use 'auto', 'scatter', 'binned' or 'sample'")
+
+        trend_x, trend_y = self.wait_time_trendline()
+        fig.add_trace(go.Scatter(x=trend_x, y=trend_y, name='Trend',
+                                 line={'color': 'red'}))
+        fig.update_layout(title='Total wait time vs time of referral',
+                          xaxis_title='Day of referral', yaxis_title='Total wait time')
+        return fig
 
-        # read in queue numbers csv
-        self.queue_numbers_df = pd.read_csv('queue_numbers.csv')
+    # A method to export the trial results in one bulk write - the format
+    # (parquet, arrow/feather or csv) is taken from the file extension and
+    # queue numbers are written alongside with a _queue_numbers suffix
+    def export_results(self, path):
+        root, extension = os.path.splitext(path)
+        write_table(self.all_wait_times_df, path)
+        write_table(self.queue_numbers_df, f'{root}_queue_numbers{extension}')
+
+    # A method to return the exported tables as file names and bytes, as
+    # export_results but in memory, so sessions sharing a server never
+    # write to the same files. The bytes are kept until more runs are
+    # added, so showing the results again does not export them again
+    def export_results_bytes(self, name='results', extension=None):
+        if extension is None:
+            extension = default_extension()
+        key = (name, extension, len(self.run_results))
+        if key not in self.exported_bytes:
+            self.exported_bytes = {key: {
+                f'{name}{extension}': table_bytes(self.all_wait_times_df, extension),
+                f'{name}_queue_numbers{extension}': table_bytes(self.queue_numbers_df,
+                                                               extension)}}
+        return self.exported_bytes[key]
+
+    # method to calculate average queue numbers over all runs so far
+    def calculate_mean_queue_numbers(self):
+        import pandas as pd
 
         # calculate mean queue numbers
         data = {
             'name': ['Clinic', 'Imaging', 'Hand Therapy', 'Theatres'],
             'Before': [self.fill_clinic_q, self.fill_imaging_q, self.fill_therapy_q, self.fill_theatre_q],
-            'After': [self.queue_numbers_df['clinic_q'].mean(),
-                        self.queue_numbers_df['imaging_q'].mean(),
-                        self.queue_numbers_df['therapy_q'].mean(),
-                        self.queue_numbers_df['theatres_q'].mean()]
+            'After': [self.running_stats['clinic_q'].mean,
+                        self.running_stats['imaging_q'].mean,
+                        self.running_stats['therapy_q'].mean,
+                        self.running_stats['theatres_q'].mean]
         }
 
         # create dataframe
@@ -91,6 +455,8 @@ class Trial_Results_Calculator:
 
     # plot the average queue numbers
     def plot_queue_numbers(self):
+        import plotly.express as px
+
         fig = px.bar(self.overall_q_numbers_df, barmode='group',
                      title='Numbers in waiting lists at start and end of simulation',
                      labels={'value': 'Patients waiting',
@@ -106,8 +472,10 @@ class Trial_Results_Calculator:
     # method to calculate average wait time at start of simulation
     def readout_wait_time_start(self):
 
-        #read trial results csv
-        trial_results_df = pd.read_csv('all_wait_times.csv')
+        if self.summary_mode:
+            return self.start_waits.mean
+
+        trial_results_df = self.all_wait_times_df
 
         #return average wait time for patients who entered pathway on day 0
         return trial_results_df[trial_results_df['time_entered_pathway'] < 1]['overall_q_time'].mean()
@@ -115,9 +483,62 @@ class Trial_Results_Calculator:
     # method to calculate average wait time at end of simulation
     def readout_wait_time_end(self):
 
-        # read trial results csv
-        trial_results_df = pd.read_csv('all_wait_times.csv')
-
         # return average wait time for patients who entered pathway on final day of simulation
         last_day = self.sim_duration - 1
+
+        if self.summary_mode:
+            return self.end_waits.mean
+
+        trial_results_df = self.all_wait_times_df
+
         return trial_results_df[trial_results_df['time_entered_pathway'] > last_day]['overall_q_time'].mean()
+
+    # method to calculate the Kaplan-Meier estimate of total waits, for
+    # runs stopped at sim_duration - waits of patients still in the
+    # pathway are counted as censored, so the estimate is not biased
+    # towards the shorter waits of patients who had finished
+    def calculate_wait_time_survival(self):
+        censored = self.censored_waits_df['overall_q_time'] \
+            if self.censored_waits_df is not None else []
+        self.wait_time_survival_df = kaplan_meier(
+            self.all_wait_times_df['overall_q_time'], censored)
+        return self.wait_time_survival_df
+
+    # method to return the Kaplan-Meier estimate of a quantile of the total
+    # wait, or nan if too many waits were censored to reach it
+    def readout_wait_time_survival_quantile(self, q=0.5):
+        df = self.wait_time_survival_df
+        reached = df[df['still_waiting'] <= 1 - q]
+        return reached['wait'].iloc[0] if len(reached) else float('nan')
+
+    # method to plot the Kaplan-Meier estimate of the proportion of
+    # patients still waiting against total wait time
+    def plot_wait_time_survival(self):
+        import plotly.express as px
+
+        fig = px.line(self.wait_time_survival_df, x='wait', y='still_waiting',
+                      line_shape='hv',
+                      title='Proportion of patients still waiting (Kaplan-Meier estimate)',
+                      labels={'wait': 'Total wait time',
+                              'still_waiting': 'Proportion still waiting'})
+        fig.update_yaxes(range=[0, 1])
+        return fig
+
+    # method to return wait time quantiles and 18 week breach percentages
+    # for each stage, from the sketches of summary mode
+    def readout_wait_time_quantiles(self):
+        return self.wait_time_summary.overall_df()
+
+    # method to plot wait time quantiles by day of referral, from the
+    # sketches of summary mode
+    def plot_wait_time_quantiles(self):
+        import plotly.express as px
+
+        df = self.wait_time_summary.quantiles_df()
+        df = df[df['stage'] == 'overall']
+        fig = px.line(df, x='referral_day', y=['p50', 'p90', 'p99'],
+                      title='Total wait time percentiles vs time of referral',
+                      labels={'referral_day': 'Day of referral',
+                              'value': 'Total wait time',
+                              'variable': 'Percentile'})
+        return fig
@@ -0,0 +1,206 @@
+# A class to record patient wait times during a simulation run
+
+# only the standard library is imported at module level, so simulation
+# workers start quickly - numpy and pandas are imported when converting to
+# and from dataframes and arrays
+
+import math
+from array import array
+from statistics import fmean
+
+
+# function to convert a column of values - a list or numpy array - to a
+# typed array of doubles
+def double_array(values):
+    if isinstance(values, (list, tuple, array)):
+        return array('d', values)
+    import numpy as np
+    return array('d', np.ascontiguousarray(values, dtype=float).tobytes())
+
+
+class Wait_Time_Recorder:
+
+    # names of the recorded columns, in output order
+    columns = ('time_entered_pathway', 'overall_q_time',
+               'clinic_q_time', 'theatre_q_time')
+
+    def __init__(self):
+        # one typed, growable column per recorded value - appending to an
+        # array is amortised O(1), unlike concatenating dataframes
+        self.time_entered_pathway = array('d')
+        self.overall_q_time = array('d')
+        self.clinic_q_time = array('d')
+        self.theatre_q_time = array('d')
+
+    def __len__(self):
+        return len(self.time_entered_pathway)
+
+    # method to create a recorder from existing columns of queue times
+    @classmethod
+    def from_columns(cls, **columns):
+        recorder = cls()
+        for name in cls.columns:
+            getattr(recorder, name).extend(double_array(columns[name]))
+        return recorder
+
+    # method to record the queue times of a discharged patient
+    def record(self, patient):
+        self.time_entered_pathway.append(patient.time_entered_pathway)
+        self.overall_q_time.append(patient.overall_q_time)
+        self.clinic_q_time.append(patient.clinic_q_time)
+        self.theatre_q_time.append(patient.theatre_q_time)
+
+    # method to convert the recorded columns to a dataframe
+    def to_dataframe(self):
+        import numpy as np
+        import pandas as pd
+
+        data = {name: np.array(getattr(self, name), dtype=float)
+                for name in self.columns}
+        return pd.DataFrame(data)
+
+
+class Queue_Length_Recorder:
+
+    # names of the recorded columns, in output order
+    columns = ('time', 'clinic_q', 'imaging_q', 'therapy_q', 'theatre_q')
+
+    def __init__(self, interval, max_samples):
+        # samples are taken every interval days into columns preallocated
+        # for max_samples. When they are full, every other sample is
+        # dropped and the interval doubled, so memory stays bounded however
+        # long the run
+        self.interval = interval
+        self.max_samples = max_samples + max_samples % 2
+        self.count = 0
+        for name in self.columns:
+            setattr(self, name, array('d', bytes(8 * self.max_samples)))
+
+    def __len__(self):
+        return self.count
+
+    # method to return the interval between samples that keeps the samples
+    # from time zero to duration within max_samples
+    @staticmethod
+    def fitted_interval(interval, max_samples, duration):
+        max_samples += max_samples % 2
+        while int(duration / interval) + 1 > max_samples:
+            interval *= 2
+        return interval
+
+    # method to return the time the next sample is due
+    def next_time(self):
+        return self.count * self.interval
+
+    # method to record the numbers in each queue at time
+    def record(self, time, clinic_q, imaging_q, therapy_q, theatre_q):
+        if self.count == self.max_samples:
+            self.downsample()
+        i = self.count
+        self.time[i] = time
+        self.clinic_q[i] = clinic_q
+        self.imaging_q[i] = imaging_q
+        self.therapy_q[i] = therapy_q
+        self.theatre_q[i] = theatre_q
+        self.count += 1
+
+    # method to halve the samples, keeping every other one
+    def downsample(self):
+        kept = (self.count + 1) // 2
+        for name in self.columns:
+            column = getattr(self, name)
+            column[:kept] = column[:self.count:2]
+        self.count = kept
+        self.interval *= 2
+
+    # method to create a recorder from columns of samples taken every
+    # interval days
+    @classmethod
+    def from_columns(cls, interval, **columns):
+        samples = len(columns['time'])
+        recorder = cls(interval, samples)
+        for name in cls.columns:
+            getattr(recorder, name)[:samples] = double_array(columns[name])
+        recorder.count = samples
+        return recorder
+
+    # method to convert the recorded samples to a dataframe
+    def to_dataframe(self):
+        import numpy as np
+        import pandas as pd
+
+        data = {name: np.array(getattr(self, name)[:self.count], dtype=float)
+                for name in self.columns}
+        return pd.DataFrame(data)
+
+
+class Run_Results:
+    def __init__(self, run_number, wait_times, clinic_q, imaging_q,
+                 therapy_q, theatre_q, queue_lengths=None, censored_waits=None):
+
+        # wait_times is the Wait_Time_Recorder for the run - queue numbers
+        # are the numbers in each queue at the end of the run, and
+        # queue_lengths the Queue_Length_Recorder of samples during it.
+        # Runs stopped at sim_duration also have censored_waits, a
+        # Wait_Time_Recorder of how long patients still waiting had waited
+        # so far (only the overall wait is known, other stages are nan)
+        self.run_number = run_number
+        self.wait_times = wait_times
+        self.censored_waits = censored_waits
+
+        self.clinic_q = clinic_q
+        self.imaging_q = imaging_q
+        self.therapy_q = therapy_q
+        self.theatre_q = theatre_q
+
+        self.queue_lengths = queue_lengths
+
+    # method to return the wait times as a dataframe tagged with the run
+    def wait_times_df(self):
+        df = self.wait_times.to_dataframe()
+        df.insert(0, 'run', self.run_number)
+        return df
+
+    # method to return the queue length samples as a dataframe tagged with
+    # the run, or None if they were not recorded
+    def queue_lengths_df(self):
+        if self.queue_lengths is None:
+            return None
+        df = self.queue_lengths.to_dataframe()
+        df.insert(0, 'run', self.run_number)
+        return df
+
+    # method to return the censored waits as a dataframe tagged with the
+    # run, or None if the run was not stopped at sim_duration
+    def censored_waits_df(self):
+        if self.censored_waits is None:
+            return None
+        df = self.censored_waits.to_dataframe()
+        df.insert(0, 'run', self.run_number)
+        return df
+
+    # method to summarise the run - total in queues at the end, and mean
+    # waits overall and for patients referred on the first and last day
+    def summary(self, sim_duration):
+        entered = self.wait_times.time_entered_pathway
+        waits = self.wait_times.overall_q_time
+        last_day = sim_duration - 1
+
+        def mean_wait(referred):
+            return fmean(referred) if referred else math.nan
+
+        return {'total_q': self.clinic_q + self.imaging_q + self.therapy_q + self.theatre_q,
+                'mean_wait': mean_wait(waits),
+                'wait_time_start': mean_wait([wait for day, wait in zip(entered, waits)
+                                              if day < 1]),
+                'wait_time_end': mean_wait([wait for day, wait in zip(entered, waits)
+                                            if day > last_day]),
+                'patients': len(waits)}
+
+    # method to return the queue numbers as a row of the queue numbers table
+    def queue_numbers_row(self):
+        return {'run': self.run_number,
+                'clinic_q': self.clinic_q,
+                'imaging_q': self.imaging_q,
+                'therapy_q': self.therapy_q,
+                'theatres_q': self.theatre_q}
@@ -0,0 +1,130 @@
+# A class to measure where the time of a simulation run goes - passed to
+# Hand_Surgery_Pathway.run(), which runs exactly as before without one
+
+import os
+import time
+
+
+class Run_Profiler:
+    def __init__(self, memory = False, profile_path = None):
+
+        # measuring peak memory with tracemalloc slows a run down several
+        # times, so phase times are only comparable between runs measured
+        # the same way. profile_path, if given, is written with a cProfile
+        # dump of the run (.prof, for snakeviz or pstats) or a pyinstrument
+        # report (.html)
+        self.memory = memory
+        self.profile_path = profile_path
+
+        # structured results of the last run profiled
+        self.report = None
+
+    # method to run a started model in phases - time zero (prefilling and
+    # the first referrals), the main loop up to sim_duration and the drain
+    # of patients referred before then, unless the model stops at
+    # sim_duration - counting the events processed and
+    # the peak number of patients in the pathway, then build its results
+    # with build_results
+    def run(self, model, build_results):
+        env = model.env
+        step = env.step
+        events = 0
+        peak_patients = model.active_entities
+
+        def counting_step():
+            nonlocal events, peak_patients
+            events += 1
+            step()
+            if model.active_entities > peak_patients:
+                peak_patients = model.active_entities
+
+        profiler = self.start_profile()
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+
+        env.step = counting_step
+        phases = {}
+        phase_events = {}
+        clock, counted = time.perf_counter(), 0
+
+        # function to record the time and events since the last phase ended
+        def end_phase(phase):
+            nonlocal clock, counted
+            now = time.perf_counter()
+            phases[phase] = now - clock
+            phase_events[phase] = events - counted
+            clock, counted = now, events
+
+        try:
+            self.run_time_zero(model)
+            end_phase('prefill')
+            if env.now < model.sim_duration:
+                env.run(until=model.sim_duration)
+            end_phase('main_loop')
+            if not model.stop_at_horizon:
+                env.run(until=model.end_of_sim)
+            end_phase('drain')
+            results = build_results()
+            end_phase('results')
+        finally:
+            del env.step
+            peak_memory = None
+            if self.memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.stop_profile(profiler)
+
+        wall_time = sum(phases.values())
+        self.report = {
+            'run_number': model.run_number,
+            'events': events,
+            'events_per_second': events / wall_time if wall_time else None,
+            'wall_time': wall_time,
+            'phase_seconds': phases,
+            'phase_events': phase_events,
+            'end_time': env.now,
+            'patients': model.patient_counter,
+            'peak_patients': peak_patients,
+            'peak_memory_bytes': peak_memory,
+            'profile_path': self.profile_path,
+        }
+        return results
+
+    # method to start the model and process every event at time zero - a
+    # model already started, e.g. run part way with run_until or restored
+    # from a Checkpoint.Pathway_Snapshot, carries on from where it is
+    @staticmethod
+    def run_time_zero(model):
+        if model.started:
+            return
+        model.start()
+        env = model.env
+        while env.peek() == 0:
+            env.step()
+
+    # method to start cProfile or pyinstrument, if profiling
+    def start_profile(self):
+        if self.profile_path is None:
+            return None
+        if os.path.splitext(self.profile_path)[1].lower() == '.html':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    # method to stop profiling and write the profile
+    def stop_profile(self, profiler):
+        if profiler is None:
+            return
+        if hasattr(profiler, 'stop'):
+            profiler.stop()
+            with open(self.profile_path, 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(self.profile_path)
@@ -0,0 +1,73 @@
+# A class to keep a running mean, variance and confidence interval of a
+# value as results arrive, without storing every value
+
+import math
+
+
+class Running_Stats:
+    def __init__(self):
+
+        # count, mean and sum of squared differences from the mean, updated
+        # with Welford's method
+        self.count = 0
+        self.mean = math.nan
+        self.m2 = 0.0
+
+    # method to create a Running_Stats from the count, mean and sum of
+    # squared differences of a batch of values, e.g. calculated with numpy
+    @classmethod
+    def from_moments(cls, count, mean, m2):
+        stats = cls()
+        if count > 0:
+            stats.count, stats.mean, stats.m2 = count, mean, m2
+        return stats
+
+    # method to add a value - missing values (nan) are skipped, e.g. a run
+    # with no referrals on the last day has no end of simulation wait
+    def add(self, value):
+        if math.isnan(value):
+            return
+        self.count += 1
+        if self.count == 1:
+            self.mean = value
+            return
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    # method to combine the values of another Running_Stats into this one,
+    # e.g. from runs summarised in another process
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    # method to return the sample variance
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    # method to return the half width of the confidence interval of the mean
+    def ci_half_width(self, confidence=0.95):
+        if self.count < 2:
+            return math.nan
+        from scipy.stats import t
+        t_value = t.ppf((1 + confidence) / 2, self.count - 1)
+        return t_value * math.sqrt(self.variance() / self.count)
+
+    # method to return the half width relative to the mean - zero if every
+    # value is the same, e.g. a queue that is always empty, so it counts
+    # as precise whatever its mean
+    def relative_half_width(self, confidence=0.95):
+        half_width = self.ci_half_width(confidence)
+        if half_width == 0:
+            return 0.0
+        if self.mean == 0:
+            return math.nan
+        return half_width / abs(self.mean)
@@ -0,0 +1,164 @@
+# A command line runner for files of scenarios, without Streamlit
+# e.g. python ScenarioRunner.py scenarios_example.yaml -o results.parquet
+
+import argparse
+import csv
+import inspect
+import json
+import os
+import time
+
+from HandPathway import Hand_Surgery_Pathway
+from ResultsCache import Results_Cache, cache_key
+from ResultsCalculator import Trial_Results_Calculator, write_table
+from TrialRunner import Trial_Runner, engines
+from global_params import g
+
+
+# parameters a scenario can set - the Hand_Surgery_Pathway arguments
+scenario_parameters = [name for name in
+                       inspect.signature(Hand_Surgery_Pathway.__init__).parameters
+                       if name not in ('self', 'run_number', 'seed')]
+
+
+# function to convert a value read from a CSV file to a number, boolean or
+# None where it looks like one
+def parse_value(text):
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return {'true': True, 'false': False, 'none': None}.get(text.lower(), text)
+
+
+# function to read a list of scenarios from a YAML, JSON or CSV file. YAML
+# and JSON files hold a list of scenarios, or a mapping with 'scenarios' and
+# 'defaults' applied to every scenario. CSV files have a row per scenario
+# and a column per parameter, with blank cells left at their defaults.
+# Each scenario is a dict of Hand_Surgery_Pathway arguments and an
+# optional 'name'
+def read_scenarios(path):
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='') as f:
+        if extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('Reading YAML scenario files needs PyYAML - '
+                                  'pip install pyyaml, or use JSON or CSV') from None
+            data = yaml.safe_load(f)
+        elif extension == '.json':
+            data = json.load(f)
+        elif extension == '.csv':
+            data = [{name: parse_value(value) for name, value in row.items()
+                     if value not in (None, '')}
+                    for row in csv.DictReader(f)]
+        else:
+            raise ValueError(f'Unsupported scenario file format {extension!r} - '
+                             'use .yaml, .json or .csv')
+
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get('defaults') or {}
+        data = data.get('scenarios') or []
+
+    scenarios = []
+    for number, scenario in enumerate(data, start=1):
+        scenario = {**defaults, **scenario}
+        name = str(scenario.pop('name', f'scenario_{number}'))
+        unknown = set(scenario) - set(scenario_parameters)
+        if unknown:
+            raise ValueError(f'Unknown parameters in {name}: {", ".join(sorted(unknown))}')
+        scenarios.append((name, scenario))
+    return scenarios
+
+
+# function to run each scenario's trial, printing its runtime, and return
+# the wait times, queue numbers and per scenario summary tables
+def run_scenarios(scenarios, number_of_runs = g.number_of_runs,
+                  master_seed = g.master_seed, max_workers = None,
+                  engine = g.engine, cache = None):
+    import pandas as pd
+
+    wait_times, queue_numbers, summaries = [], [], []
+
+    print(f'{"scenario":<24} {"runs":>5} {"seconds":>8} {"total queue":>12} '
+          f'{"wait start":>11} {"wait end":>9}')
+    for name, params in scenarios:
+        start = time.perf_counter()
+        trial_runner = Trial_Runner(number_of_runs, master_seed, max_workers,
+                                    engine, **params)
+        if cache is None:
+            run_results = trial_runner.run_trial()
+        else:
+            run_results = cache.get_or_run(
+                cache_key(params, number_of_runs, master_seed, engine),
+                trial_runner.run_trial)
+
+        calculator = Trial_Results_Calculator(
+            number_of_runs, **{key: value for key, value in params.items()
+                               if key in ('sim_duration', 'fill_clinic_q', 'fill_imaging_q',
+                                          'fill_therapy_q', 'fill_theatre_q')})
+        calculator.add_run_results(run_results)
+        calculator.concatenate_wait_times()
+        calculator.calculate_mean_queue_numbers()
+        seconds = time.perf_counter() - start
+
+        summary = {'scenario': name, 'runs': number_of_runs, 'seconds': seconds,
+                   'total_q': calculator.readout_total_queue_numbers(),
+                   'wait_time_start': calculator.readout_wait_time_start(),
+                   'wait_time_end': calculator.readout_wait_time_end(),
+                   **params}
+        summaries.append(summary)
+        print(f'{name:<24} {number_of_runs:>5} {seconds:>8.2f} {summary["total_q"]:>12.1f} '
+              f'{summary["wait_time_start"]:>11.1f} {summary["wait_time_end"]:>9.1f}')
+
+        calculator.all_wait_times_df.insert(0, 'scenario', name)
+        calculator.queue_numbers_df.insert(0, 'scenario', name)
+        wait_times.append(calculator.all_wait_times_df)
+        queue_numbers.append(calculator.queue_numbers_df)
+
+    return (pd.concat(wait_times, ignore_index=True),
+            pd.concat(queue_numbers, ignore_index=True),
+            pd.DataFrame(summaries))
+
+
+# function to run the scenarios in a file and write the results in one bulk
+# write per table - wait times to output, and queue numbers and scenario
+# summaries alongside with _queue_numbers and _scenarios suffixes
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the hand surgery pathway simulation for a file of scenarios')
+    parser.add_argument('scenarios', help='YAML, JSON or CSV file of scenarios')
+    parser.add_argument('-o', '--output', default='results.parquet',
+                        help='wait times file (.parquet, .arrow, .feather or .csv)')
+    parser.add_argument('-n', '--runs', type=int, default=g.number_of_runs,
+                        help='runs per scenario')
+    parser.add_argument('-s', '--seed', type=int, default=g.master_seed,
+                        help='master seed')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-e', '--engine', choices=list(engines) + ['batch'],
+                        default=g.engine, help='simulation backend')
+    parser.add_argument('--cache', action='store_true',
+                        help=f'reuse results stored in {g.results_cache_path}')
+    args = parser.parse_args(argv)
+
+    scenarios = read_scenarios(args.scenarios)
+    cache = Results_Cache() if args.cache else None
+
+    start = time.perf_counter()
+    wait_times, queue_numbers, summaries = run_scenarios(
+        scenarios, args.runs, args.seed, args.workers, args.engine, cache)
+
+    root, extension = os.path.splitext(args.output)
+    write_table(wait_times, args.output)
+    write_table(queue_numbers, f'{root}_queue_numbers{extension}')
+    write_table(summaries, f'{root}_scenarios{extension}')
+    print(f'{len(scenarios)} scenarios in {time.perf_counter() - start:.2f}s, '
+          f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
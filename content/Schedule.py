@@ -0,0 +1,237 @@
+# Classes to compile a schedule of changes to capacity and demand part way
+# through a run, and closures of stages (e.g. bank holidays), into sorted
+# arrays of session open and close times, so patients are booked straight
+# into the next session instead of processes opening and closing each stage
+
+import math
+from bisect import bisect_right
+
+
+# parameters a schedule can change part way through a run
+schedule_parameters = ('referrals_per_week', 'surg_clinic_per_week', 'surg_clinic_appts',
+                       'imaging_weekly_appts', 'therapy_weekly_appts',
+                       'theatre_list_per_week', 'theatre_list_capacity',
+                       'trauma_list_per_week', 'trauma_extra_patients')
+
+# stages a closure can apply to, and their queue counters
+closure_stages = {'clinic': 'clinic_q', 'imaging': 'imaging_q',
+                  'therapy': 'therapy_q', 'theatres': 'theatre_q'}
+
+
+# function to return the session interval and appointment length of each
+# stage, and the referral interval, from a set of parameters, as
+# Hand_Surgery_Pathway works them out. Stages without capacity have None
+def stage_timings(params):
+    extra_per_list = 0
+    if params['theatre_list_per_week'] > 0:
+        extra_per_list = (params['trauma_extra_patients'] * params['trauma_list_per_week']
+                          / params['theatre_list_per_week'])
+    theatre_capacity = params['theatre_list_capacity'] + extra_per_list
+
+    def sessions(per_week, appointments):
+        if per_week <= 0 or appointments <= 0:
+            return None
+        return 7 / per_week, 1 / appointments
+
+    def appointments(per_week):
+        return 7 / per_week if per_week > 0 else None
+
+    return {'clinic_q': sessions(params['surg_clinic_per_week'], params['surg_clinic_appts']),
+            'imaging_q': appointments(params['imaging_weekly_appts']),
+            'therapy_q': appointments(params['therapy_weekly_appts']),
+            'theatre_q': sessions(params['theatre_list_per_week'], theatre_capacity),
+            'referral_interval': appointments(params['referrals_per_week'])}
+
+
+# function to return the parts of windows (open, close, appointment length)
+# outside sorted, non overlapping closures (start, end)
+def without_closures(windows, closures):
+    first = 0
+    for opens, closes, duration in windows:
+        while first < len(closures) and closures[first][1] <= opens:
+            first += 1
+        i = first
+        while opens < closes:
+            if i < len(closures) and closures[i][0] < closes:
+                start, end = closures[i]
+                if start > opens:
+                    yield opens, start, duration
+                opens = max(opens, end)
+                i += 1
+            else:
+                yield opens, closes, duration
+                break
+
+
+# function to sort closures and merge any that overlap
+def merge_closures(closures):
+    merged = []
+    for start, end in sorted(closures):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class Stage_Calendar:
+    def __init__(self, windows, until):
+
+        # sorted arrays of when each session opens and closes and its
+        # appointment length, compiled up to until and extended from
+        # windows if a run goes on past them
+        self.windows = windows
+        self.opens = []
+        self.closes = []
+        self.durations = []
+        self.extend(until)
+
+    # method to compile sessions until one closes after time, or there are
+    # no more
+    def extend(self, time):
+        while self.windows is not None and (not self.closes or self.closes[-1] <= time):
+            window = next(self.windows, None)
+            if window is None:
+                self.windows = None
+                break
+            opens, closes, duration = window
+            self.opens.append(opens)
+            self.closes.append(closes)
+            self.durations.append(duration)
+
+    # method to return when the next appointment at or after time can start,
+    # and its length - appointments start while a session is open, and the
+    # last may run on after it closes
+    def next_start(self, time):
+        if not self.closes or self.closes[-1] <= time:
+            self.extend(time)
+        i = bisect_right(self.opens, time) - 1
+        if i >= 0 and time < self.closes[i]:
+            return time, self.durations[i]
+        if i + 1 < len(self.opens):
+            return self.opens[i + 1], self.durations[i + 1]
+        return math.inf, 0
+
+    # method to book the patient at the front of the queue at now into the
+    # next appointment, returning the days until it starts and until it
+    # ends
+    def book(self, now):
+        start, duration = self.next_start(now)
+        wait = start - now
+        return wait, wait + duration
+
+
+class Pathway_Schedule:
+    def __init__(self, schedule, parameters):
+
+        # schedule is a dict of 'changes', a list of dicts of the day a
+        # change takes effect and new values of any of schedule_parameters,
+        # and 'closures', a list of dicts of the start and end days of a
+        # closure and the stages it closes (all of them if not given).
+        # parameters are the values before the first change
+        if not isinstance(schedule, dict):
+            raise TypeError("A schedule is a dict of 'changes' and 'closures'")
+        unknown = set(schedule) - {'changes', 'closures'}
+        if unknown:
+            raise ValueError(f'Unknown schedule entries: {", ".join(sorted(unknown))} - '
+                             "use 'changes' and 'closures'")
+        changes = sorted(schedule.get('changes', []), key=lambda change: change['day'])
+        self.change_days = [0]
+        self.regimes = [stage_timings(parameters)]
+        self.referral_rates = [parameters['referrals_per_week']]
+        current = dict(parameters)
+        for change in changes:
+            unknown = set(change) - {'day'} - set(schedule_parameters)
+            if unknown:
+                raise ValueError(f'Unknown schedule parameters: {", ".join(sorted(unknown))}')
+            current.update({name: value for name, value in change.items() if name != 'day'})
+            if change['day'] <= 0:
+                self.regimes[0] = stage_timings(current)
+                self.referral_rates[0] = current['referrals_per_week']
+                continue
+            self.change_days.append(change['day'])
+            self.regimes.append(stage_timings(current))
+            self.referral_rates.append(current['referrals_per_week'])
+
+        missing = [stage for stage, timing in self.regimes[-1].items()
+                   if timing is None and stage != 'referral_interval']
+        if missing:
+            raise ValueError('Every stage needs capacity after the last change - '
+                             f'none for {", ".join(missing)}')
+
+        self.closures = {stage: [] for stage in closure_stages.values()}
+        for closure in schedule.get('closures', []):
+            stages = closure.get('stages', list(closure_stages))
+            unknown = set(stages) - set(closure_stages)
+            if unknown:
+                raise ValueError(f'Unknown stages to close: {", ".join(sorted(unknown))}')
+            for stage in stages:
+                self.closures[closure_stages[stage]].append((closure['start'], closure['end']))
+        for stage, closures in self.closures.items():
+            self.closures[stage] = merge_closures(closures)
+
+        # whether the schedule changes nothing, so a run can go without it
+        self.empty = not changes and not any(self.closures.values())
+
+    # method to return the index of the regime in effect at time
+    def regime_index(self, time):
+        return bisect_right(self.change_days, time) - 1
+
+    # method to return the sessions of a clinic or theatre list - open for
+    # a day, then closed for the session interval in effect when it opened.
+    # Unlike clinic_unavail and theatres_unavail, a session closes on time
+    # even if its last appointment runs on, so the next opens on time too
+    def session_windows(self, stage):
+        time = 0.0
+        while True:
+            i = self.regime_index(time)
+            timing = self.regimes[i][stage]
+            if timing is None:
+                # no sessions until capacity is restored
+                time = self.change_days[i + 1]
+                continue
+            interval, duration = timing
+            yield time, time + 1, duration
+            time += 1 + interval
+
+    # method to return the windows imaging or therapy is open - always,
+    # between changes to the number of appointments
+    def appointment_windows(self, stage):
+        for i, day in enumerate(self.change_days):
+            duration = self.regimes[i][stage]
+            if duration is None:
+                continue
+            closes = self.change_days[i + 1] if i + 1 < len(self.change_days) else math.inf
+            yield day, closes, duration
+
+    # method to compile a calendar for each stage up to until, keyed by the
+    # stage's queue counter
+    def stage_calendars(self, until):
+        calendars = {}
+        for stage in closure_stages.values():
+            if stage in ('clinic_q', 'theatre_q'):
+                windows = self.session_windows(stage)
+            else:
+                windows = self.appointment_windows(stage)
+            calendars[stage] = Stage_Calendar(without_closures(windows, self.closures[stage]),
+                                              until)
+        return calendars
+
+    # method to sample the days from now to the next referral - a Poisson
+    # process whose rate changes with the schedule, so a draw that passes a
+    # change is drawn again from the change at the new rate
+    def referral_delay(self, now, rng):
+        waited = 0.0
+        while True:
+            i = self.regime_index(now)
+            next_change = (self.change_days[i + 1] if i + 1 < len(self.change_days)
+                           else math.inf)
+            interval = self.regimes[i]['referral_interval']
+            if interval is not None:
+                delay = rng.expovariate(1.0 / interval)
+                if now + delay < next_change:
+                    return waited + delay
+            if next_change == math.inf:
+                return math.inf
+            waited += next_change - now
+            now = next_change
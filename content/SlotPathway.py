@@ -0,0 +1,254 @@
+# A class to model the GSTT hand surgery pathway by assigning patients to
+# the next free appointment slot at each stage, without running SimPy
+
+from bisect import bisect_right
+from heapq import merge
+
+from HandPatient import Patient
+from HandPathway import Hand_Surgery_Pathway
+from ResultsRecorder import Wait_Time_Recorder, Queue_Length_Recorder, Run_Results
+
+
+# function to find the start times of patients, in FIFO order, at a stage
+# with one appointment at a time and no closures (imaging and therapy)
+def fifo_slot_starts(arrivals, duration):
+    starts = []
+    free = 0.0
+    for arrival in arrivals:
+        start = arrival if arrival > free else free
+        starts.append(start)
+        free = start + duration
+    return starts
+
+
+# function to find the start times of patients, in FIFO order, at a stage
+# that closes between sessions (clinics and theatre lists). This follows
+# clinic_unavail/theatres_unavail: a session lasts one day, then the stage
+# closes for interval days once the case in progress has finished
+def session_slot_starts(arrivals, duration, interval):
+    starts = []
+    free = 0.0
+    closes = 1.0
+    for arrival in arrivals:
+        start = arrival if arrival > free else free
+        while start >= closes:
+            reopens = (closes if closes > free else free) + interval
+            closes = reopens + 1
+            free = reopens
+            start = arrival if arrival > free else free
+        starts.append(start)
+        free = start + duration
+    return starts
+
+
+# function to find, at a stage with a Schedule.Stage_Calendar, the times
+# patients reach the front of the queue in FIFO order and are booked into
+# the next session, and the times their appointments start and end - as the
+# simpy model works them out
+def calendar_slot_starts(arrivals, calendar):
+    booked, starts, ends = [], [], []
+    free = 0.0
+    for arrival in arrivals:
+        now = arrival if arrival > free else free
+        wait, appointment = calendar.book(now)
+        booked.append(now)
+        starts.append(now + wait)
+        free = now + appointment
+        ends.append(free)
+    return booked, starts, ends
+
+
+# function to order departures from different stages arriving at the next
+# one - simultaneous departures are ordered by start time, as SimPy
+# processes events scheduled earlier first
+def departure_order(departure):
+    return departure[0], departure[1]
+
+
+# function to count patients who have arrived at a stage but not started
+def count_waiting(arrivals, starts, time):
+    return sum(1 for arrival, start in zip(arrivals, starts)
+               if arrival <= time <= start)
+
+
+# function to count patients who have arrived at a stage but not started
+# at each of a list of times
+def count_waiting_at(arrivals, starts, times):
+    arrivals = sorted(arrivals)
+    starts = sorted(starts)
+    return [bisect_right(arrivals, time) - bisect_right(starts, time)
+            for time in times]
+
+
+class Slot_Hand_Surgery_Pathway(Hand_Surgery_Pathway):
+
+    # method to return when patients arriving at a stage in FIFO order leave
+    # its queue, and start and end their appointments
+    def stage_slots(self, stage, arrivals):
+        if self.calendars is not None:
+            return calendar_slot_starts(arrivals, self.calendars[stage])
+
+        if stage == 'clinic_q':
+            duration = self.surg_clinic_duration
+            starts = session_slot_starts(arrivals, duration, self.surg_clinic_interval)
+        elif stage == 'theatre_q':
+            duration = self.theatre_case_duration
+            starts = session_slot_starts(arrivals, duration, self.theatre_list_interval)
+        else:
+            duration = self.imaging_interval if stage == 'imaging_q' else self.therapy_interval
+            starts = fifo_slot_starts(arrivals, duration)
+        return starts, starts, [start + duration for start in starts]
+
+    # method to work out every patient's arrival and start times at each
+    # stage, returning the end of simulation time, per stage (arrivals,
+    # times leaving the queue, patients) in the order patients were seen,
+    # and theatre start times
+    def assign_slots(self, backlogs, referrals):
+
+        clinic_backlog, imaging_backlog, therapy_backlog, theatre_backlog = backlogs
+
+        # clinic - prefilled patients are ahead of every referral
+        clinic_patients = list(clinic_backlog) + referrals
+        clinic_arrivals = [0.0] * len(clinic_backlog) + \
+            [pt.time_entered_pathway for pt in referrals]
+        clinic_booked, clinic_starts, clinic_ends = self.stage_slots('clinic_q',
+                                                                     clinic_arrivals)
+
+        # route patients on from clinic
+        to_imaging, to_therapy, to_theatres = [], [], []
+        for start, end, pt in zip(clinic_starts, clinic_ends, clinic_patients):
+            pt.clinic_q_time = start - pt.time_entered_pathway
+            departure = (end, start, pt)
+            if pt.needs_imaging:
+                to_imaging.append(departure)
+            elif pt.needs_therapy:
+                to_therapy.append(departure)
+            else:
+                to_theatres.append(departure)
+
+        # imaging
+        imaging_queue = [(0.0, 0.0, pt) for pt in imaging_backlog] + to_imaging
+        imaging_arrivals = [arrival for arrival, _, pt in imaging_queue]
+        imaging_booked, imaging_starts, imaging_ends = self.stage_slots('imaging_q',
+                                                                        imaging_arrivals)
+
+        from_imaging_to_therapy, from_imaging_to_theatres = [], []
+        for start, end, (arrival, _, pt) in zip(imaging_starts, imaging_ends, imaging_queue):
+            departure = (end, start, pt)
+            if pt.needs_therapy:
+                from_imaging_to_therapy.append(departure)
+            else:
+                from_imaging_to_theatres.append(departure)
+
+        # therapy
+        therapy_queue = [(0.0, 0.0, pt) for pt in therapy_backlog] + \
+            list(merge(to_therapy, from_imaging_to_therapy, key=departure_order))
+        therapy_arrivals = [arrival for arrival, _, pt in therapy_queue]
+        therapy_booked, therapy_starts, therapy_ends = self.stage_slots('therapy_q',
+                                                                        therapy_arrivals)
+
+        from_therapy = [(end, start, pt) for start, end, (arrival, _, pt)
+                        in zip(therapy_starts, therapy_ends, therapy_queue)]
+
+        # theatres
+        theatre_queue = [(0.0, 0.0, pt) for pt in theatre_backlog] + \
+            list(merge(to_theatres, from_imaging_to_theatres, from_therapy,
+                       key=departure_order))
+        theatre_arrivals = [arrival for arrival, _, pt in theatre_queue]
+        theatre_patients = [pt for arrival, _, pt in theatre_queue]
+        theatre_booked, theatre_starts, theatre_ends = self.stage_slots('theatre_q',
+                                                                        theatre_arrivals)
+
+        # the sim ends once sim_duration has passed and every patient
+        # referred before then has been through theatres
+        end = self.sim_duration
+        for theatre_end, pt in zip(theatre_ends, theatre_patients):
+            if pt.before_end_sim:
+                end = max(end, theatre_end)
+
+        stages = [(clinic_arrivals, clinic_booked, clinic_patients),
+                  (imaging_arrivals, imaging_booked, None),
+                  (therapy_arrivals, therapy_booked, None),
+                  (theatre_arrivals, theatre_booked, theatre_patients)]
+        return end, stages, theatre_starts
+
+    # A method to run the simulation - there are no simpy events to profile,
+    # so profiler is only accepted to match Hand_Surgery_Pathway.run
+    def run(self, profiler=None):
+        if profiler is not None:
+            raise ValueError('Only the simpy engine can be profiled')
+
+        backlogs = self.create_prefill_patients()
+
+        # generate referrals up to a horizon, and extend it until it covers
+        # the end of simulation. Stages only depend on earlier arrivals, so
+        # later referrals cannot change the result
+        referrals = []
+        next_referral = 0.0
+        horizon = self.sim_duration
+        while True:
+            while next_referral <= horizon:
+                self.patient_counter += 1
+                pt = Patient(self.patient_counter,
+                             before_end_sim=next_referral < self.sim_duration)
+                self.determine_imaging(pt)
+                self.determine_therapy(pt)
+                pt.time_entered_pathway = next_referral
+                referrals.append(pt)
+
+                if self.compiled_schedule is None:
+                    next_referral += self.arrival_rng.expovariate(1.0/self.referral_interval)
+                else:
+                    next_referral += self.compiled_schedule.referral_delay(
+                        next_referral, self.arrival_rng)
+
+            end, stages, theatre_starts = self.assign_slots(backlogs, referrals)
+            if self.stop_at_horizon:
+                end = self.sim_duration
+                break
+            if end <= horizon:
+                break
+            horizon = end * 1.25
+
+        # numbers in each queue at the end of simulation
+        self.clinic_q, self.imaging_q, self.therapy_q, self.theatre_q = [
+            count_waiting(arrivals, starts, end)
+            for arrivals, starts, patients in stages]
+
+        # record queue times in the order patients reached theatres - if
+        # stopping at sim_duration, patients who had not reached theatres by
+        # then have waited since referral and are recorded as censored
+        censored_entered = []
+        theatre_arrivals, theatre_booked, theatre_patients = stages[-1]
+        for arrival, start, pt in zip(theatre_arrivals, theatre_starts,
+                                      theatre_patients):
+            if pt.before_end_sim and not pt.from_prefills:
+                if self.stop_at_horizon and start >= self.sim_duration:
+                    censored_entered.append(pt.time_entered_pathway)
+                    continue
+                pt.theatre_q_time = start - arrival
+                pt.overall_q_time = start - pt.time_entered_pathway
+                self.store_queue_times(pt)
+
+        censored_waits = None
+        if self.stop_at_horizon:
+            censored_entered.sort()
+            unknown = [float('nan')] * len(censored_entered)
+            censored_waits = Wait_Time_Recorder.from_columns(
+                time_entered_pathway=censored_entered,
+                overall_q_time=[self.sim_duration - entered for entered in censored_entered],
+                clinic_q_time=unknown, theatre_q_time=unknown)
+
+        # numbers in each queue at each sample time
+        if self.queue_lengths is not None:
+            interval, times = self.queue_sample_times()
+            clinic_q, imaging_q, therapy_q, theatre_q = [
+                count_waiting_at(arrivals, starts, times)
+                for arrivals, starts, patients in stages]
+            self.queue_lengths = Queue_Length_Recorder.from_columns(
+                interval, time=times, clinic_q=clinic_q, imaging_q=imaging_q,
+                therapy_q=therapy_q, theatre_q=theatre_q)
+
+        return Run_Results(self.run_number, self.recorder, *self.queue_numbers(),
+                           queue_lengths=self.queue_lengths,
+                           censored_waits=censored_waits)
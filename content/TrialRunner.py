@@ -0,0 +1,125 @@
+# A class to run multiple simulations across processes with reproducible seeds
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from HandPathway import Hand_Surgery_Pathway
+from SlotPathway import Slot_Hand_Surgery_Pathway
+from global_params import g
+
+
+# simulation backends that run one replication at a time, by name - the
+# 'batch' engine runs chunks of replications instead
+engines = {
+    'simpy': Hand_Surgery_Pathway,
+    'slot': Slot_Hand_Surgery_Pathway,
+}
+
+
+# function to derive an independent seed for each run from a master seed
+def spawn_seeds(master_seed, number_of_runs):
+    import numpy as np
+    children = np.random.SeedSequence(master_seed).spawn(number_of_runs)
+    return [int(child.generate_state(1, dtype=np.uint64)[0])
+            for child in children]
+
+
+# function to run a single simulation - defined at module level so that
+# worker processes can import it
+def run_replication(run_number, seed, params, engine=g.engine):
+    model = engines[engine](run_number, seed=seed, **params)
+    return model.run()
+
+
+# function to run a chunk of simulations at once with the batch engine -
+# imported here so workers running one replication at a time do not load
+# numpy
+def run_batch(first_run_number, number_of_runs, seed, params):
+    from BatchPathway import Batch_Hand_Surgery_Pathway
+    model = Batch_Hand_Surgery_Pathway(number_of_runs, first_run_number,
+                                       seed=seed, **params)
+    return model.run()
+
+
+class Trial_Runner:
+    def __init__(self,
+                 number_of_runs = g.number_of_runs,
+                 master_seed = g.master_seed,
+                 max_workers = None,
+                 engine = g.engine,
+                 **params):
+
+        # params are passed to Hand_Surgery_Pathway for every run
+        self.number_of_runs = number_of_runs
+        self.master_seed = master_seed
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.engine = engine
+        self.params = params
+
+        # each run's results depend only on its seed, so they are the
+        # same however many workers are used
+        self.seeds = spawn_seeds(master_seed, number_of_runs)
+
+    # method to call function with each set of arguments, across processes
+    # if there are several workers, returning results in argument order
+    def map(self, function, *iterables):
+        if self.max_workers == 1 or len(iterables[0]) == 1:
+            return list(map(function, *iterables))
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(function, *iterables))
+
+    # method to call function with each set of arguments like map, but
+    # yielding results in the order they complete. Runs not yet started are
+    # cancelled if the caller stops early
+    def imap_unordered(self, function, *iterables):
+        if self.max_workers == 1 or len(iterables[0]) == 1:
+            yield from map(function, *iterables)
+            return
+
+        executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = [executor.submit(function, *args) for args in zip(*iterables)]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # method to yield a Run_Results per run as each run completes
+    def iter_runs(self):
+        if self.engine == 'batch':
+            for chunk in self.imap_unordered(run_batch, *self.batch_chunks()):
+                yield from chunk
+            return
+
+        yield from self.imap_unordered(run_replication, range(self.number_of_runs),
+                                       self.seeds,
+                                       [self.params] * self.number_of_runs,
+                                       [self.engine] * self.number_of_runs)
+
+    # method to run all simulations, returning a Run_Results per run in
+    # run order
+    def run_trial(self):
+        if self.engine == 'batch':
+            return self.run_batch_trial()
+
+        run_numbers = range(self.number_of_runs)
+        return self.map(run_replication, run_numbers, self.seeds,
+                        [self.params] * self.number_of_runs,
+                        [self.engine] * self.number_of_runs)
+
+    # method to return the arguments of run_batch for each chunk of
+    # g.batch_chunk_size runs, seeded from the master seed - results depend
+    # only on the chunk, so are the same however many workers are used
+    def batch_chunks(self):
+        first_run_numbers = range(0, self.number_of_runs, g.batch_chunk_size)
+        chunk_sizes = [min(g.batch_chunk_size, self.number_of_runs - first)
+                       for first in first_run_numbers]
+        chunk_seeds = spawn_seeds(self.master_seed, len(chunk_sizes))
+        return (first_run_numbers, chunk_sizes, chunk_seeds,
+                [self.params] * len(chunk_sizes))
+
+    # method to run all simulations with the batch engine
+    def run_batch_trial(self):
+        chunks = self.map(run_batch, *self.batch_chunks())
+        return [results for chunk in chunks for results in chunk]
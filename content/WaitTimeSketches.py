@@ -0,0 +1,194 @@
+# Classes to summarise wait time distributions in a fixed amount of memory,
+# so results of very many runs can be combined without keeping every wait
+
+import math
+
+import numpy as np
+
+from RunningStats import Running_Stats
+from global_params import g
+
+
+class DD_Sketch:
+    # values at or below this are counted as zero
+    min_value = 1e-6
+
+    def __init__(self, relative_accuracy = g.sketch_relative_accuracy):
+
+        # DDSketch - values are counted in buckets whose bounds grow by a
+        # factor gamma, so any quantile is returned to within
+        # relative_accuracy of its true value. Values too small for a
+        # bucket (e.g. no wait at all) are counted as zero
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    # method to add an array of values
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        positive = values[values > self.min_value]
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+
+        indexes, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma),
+                                    return_counts=True)
+        bins = self.bins
+        for index, count in zip(indexes.astype(int).tolist(), counts.tolist()):
+            bins[index] = bins.get(index, 0) + count
+
+    # method to add the counts of another sketch with the same accuracy
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError('Sketches with different accuracy cannot be merged')
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    # method to return the value at quantile q (0 to 1), or nan if empty
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class Wait_Time_Summary:
+
+    # recorded wait times summarised for each stage
+    stages = {'overall': 'overall_q_time',
+              'clinic': 'clinic_q_time',
+              'theatre': 'theatre_q_time'}
+
+    def __init__(self,
+                 bucket_days = g.sketch_bucket_days,
+                 breach_days = g.breach_days,
+                 relative_accuracy = g.sketch_relative_accuracy):
+
+        # for each stage and bucket of bucket_days by day of referral, a
+        # sketch of the waits, their running mean and variance, and the
+        # number waiting longer than breach_days
+        self.bucket_days = bucket_days
+        self.breach_days = breach_days
+        self.relative_accuracy = relative_accuracy
+
+        self.sketches = {}
+        self.stats = {}
+        self.breaches = {}
+
+    # method to create the sketch, stats and breach count of a stage and
+    # bucket key, if this is its first wait
+    def create(self, key):
+        if key not in self.sketches:
+            self.sketches[key] = DD_Sketch(self.relative_accuracy)
+            self.stats[key] = Running_Stats()
+            self.breaches[key] = 0
+
+    # method to add the waits of a run's Wait_Time_Recorder - each bucket
+    # only holds a few patients per run, so statistics are calculated for
+    # all buckets at once
+    def add_recorder(self, recorder):
+        if len(recorder) == 0:
+            return
+        entered = np.asarray(recorder.time_entered_pathway, dtype=float)
+        bucket_ids, slots = np.unique((entered // self.bucket_days).astype(int),
+                                      return_inverse=True)
+        buckets = bucket_ids.tolist()
+        counts = np.bincount(slots)
+
+        for stage, column in self.stages.items():
+            waits = np.asarray(getattr(recorder, column), dtype=float)
+            means = np.bincount(slots, weights=waits) / counts
+            m2s = np.bincount(slots, weights=(waits - means[slots]) ** 2)
+            breaches = np.bincount(slots, weights=waits > self.breach_days)
+
+            for bucket, count, mean, m2, breach in zip(
+                    buckets, counts.tolist(), means.tolist(), m2s.tolist(),
+                    breaches.tolist()):
+                key = (stage, bucket)
+                self.create(key)
+                self.stats[key].merge(Running_Stats.from_moments(count, mean, m2))
+                self.breaches[key] += int(breach)
+                self.sketches[key].count += count
+
+            # count each wait in its sketch bin
+            log_gamma = self.sketches[(stage, buckets[0])].log_gamma
+            zero = waits <= DD_Sketch.min_value
+            for slot in slots[zero].tolist():
+                self.sketches[(stage, buckets[slot])].zero_count += 1
+            indexes = np.ceil(np.log(waits[~zero]) / log_gamma).astype(int)
+            for slot, index in zip(slots[~zero].tolist(), indexes.tolist()):
+                bins = self.sketches[(stage, buckets[slot])].bins
+                bins[index] = bins.get(index, 0) + 1
+
+    # method to add another summary, e.g. of runs summarised elsewhere
+    def merge(self, other):
+        for key, sketch in other.sketches.items():
+            self.create(key)
+            self.sketches[key].merge(sketch)
+            self.stats[key].merge(other.stats[key])
+            self.breaches[key] += other.breaches[key]
+
+    # method to combine the buckets of a stage for patients referred from
+    # start_day up to end_day (all days if not given), returning the
+    # sketch, running stats and number of breaches
+    def combined(self, stage, start_day=-math.inf, end_day=math.inf):
+        sketch = DD_Sketch(self.relative_accuracy)
+        stats = Running_Stats()
+        breaches = 0
+        for (key_stage, bucket), bucket_sketch in self.sketches.items():
+            if key_stage == stage and \
+                    start_day <= bucket * self.bucket_days < end_day:
+                sketch.merge(bucket_sketch)
+                stats.merge(self.stats[(key_stage, bucket)])
+                breaches += self.breaches[(key_stage, bucket)]
+        return sketch, stats, breaches
+
+    # method to return a row of quantiles, mean, standard deviation and
+    # breach percentage from a sketch, stats and number of breaches
+    @staticmethod
+    def summary_row(sketch, stats, breaches, quantiles):
+        row = {'patients': stats.count, 'mean': stats.mean,
+               'std': math.sqrt(stats.variance()) if stats.count > 1 else math.nan}
+        for q in quantiles:
+            row[f'p{round(q * 100)}'] = sketch.quantile(q)
+        row['breach_pct'] = 100 * breaches / stats.count if stats.count else math.nan
+        return row
+
+    # method to return a table of wait time quantiles and breaches for each
+    # stage and bucket of referral days - with no rows if no waits were
+    # added, e.g. from runs stopped at sim_duration before any patient
+    # reached theatres
+    def quantiles_df(self, quantiles=(0.5, 0.9, 0.99)):
+        import pandas as pd
+
+        rows = []
+        for (stage, bucket) in sorted(self.sketches):
+            key = (stage, bucket)
+            rows.append({'stage': stage, 'referral_day': bucket * self.bucket_days,
+                         **self.summary_row(self.sketches[key], self.stats[key],
+                                            self.breaches[key], quantiles)})
+        columns = ['stage', 'referral_day', 'patients', 'mean', 'std',
+                   *[f'p{round(q * 100)}' for q in quantiles], 'breach_pct']
+        return pd.DataFrame(rows, columns=columns)
+
+    # method to return a table of wait time quantiles and breaches for each
+    # stage over all referrals
+    def overall_df(self, quantiles=(0.5, 0.9, 0.99)):
+        import pandas as pd
+
+        rows = [{'stage': stage,
+                 **self.summary_row(*self.combined(stage), quantiles)}
+                for stage in self.stages]
+        return pd.DataFrame(rows).set_index('stage')
@@ -0,0 +1,728 @@
+# Benchmarks for the hand surgery pathway simulation
+# Run from the content directory, e.g. python benchmarks.py recorder
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from HandPathway import Hand_Surgery_Pathway
+from HandPatient import Patient
+from ResultsRecorder import Wait_Time_Recorder
+from SlotPathway import Slot_Hand_Surgery_Pathway
+from BatchPathway import Batch_Hand_Surgery_Pathway
+
+
+# function to create a discharged patient with some queue times
+def make_patient(i):
+    pt = Patient(i)
+    pt.time_entered_pathway = i * 0.1
+    pt.clinic_q_time = 10.0
+    pt.theatre_q_time = 20.0
+    pt.overall_q_time = 50.0
+    return pt
+
+
+# benchmark recording n patients with the columnar recorder
+def bench_recorder(sizes=(1_000, 10_000, 100_000, 1_000_000)):
+    print('Wait_Time_Recorder: record n patients and build dataframe')
+    print(f'{"patients":>10} {"seconds":>10} {"us/patient":>12}')
+    pt = make_patient(1)
+    for n in sizes:
+        start = time.perf_counter()
+        recorder = Wait_Time_Recorder()
+        for i in range(n):
+            recorder.record(pt)
+        recorder.to_dataframe()
+        elapsed = time.perf_counter() - start
+        print(f'{n:>10} {elapsed:>10.3f} {elapsed / n * 1e6:>12.3f}')
+
+
+# benchmark the previous approach of concatenating one-row dataframes
+def bench_concat(sizes=(1_000, 2_000, 4_000)):
+    print('pd.concat per patient (previous approach)')
+    print(f'{"patients":>10} {"seconds":>10} {"us/patient":>12}')
+    pt = make_patient(1)
+    for n in sizes:
+        start = time.perf_counter()
+        df = pd.DataFrame({'time_entered_pathway': [],
+                           'overall_q_time': []})
+        for i in range(n):
+            df_to_add = pd.DataFrame({'time_entered_pathway': [pt.time_entered_pathway],
+                                      'overall_q_time': [pt.overall_q_time]})
+            df = pd.concat([df, df_to_add])
+        elapsed = time.perf_counter() - start
+        print(f'{n:>10} {elapsed:>10.3f} {elapsed / n * 1e6:>12.3f}')
+
+
+# function to run a model, counting the events simpy processes
+def run_counting_events(model):
+    env = model.env
+    step = env.step
+    events = 0
+
+    def counting_step():
+        nonlocal events
+        events += 1
+        step()
+
+    env.step = counting_step
+    start = time.perf_counter()
+    model.run()
+    return events, time.perf_counter() - start
+
+
+# benchmark the number of events processed in a run at default parameters
+def bench_events(seeds=(1, 2, 3)):
+    print('Hand_Surgery_Pathway.run(): events processed at default parameters')
+    print(f'{"seed":>6} {"events":>10} {"end time":>10} {"seconds":>10}')
+    for seed in seeds:
+        model = Hand_Surgery_Pathway(0, seed=seed)
+        events, elapsed = run_counting_events(model)
+        print(f'{seed:>6} {events:>10} {model.env.now:>10.2f} {elapsed:>10.3f}')
+
+
+# function to create a model with a backlog split across the queues in the
+# same proportions as the default prefill
+def make_backlog_model(backlog, **params):
+    return Hand_Surgery_Pathway(0, seed=1,
+                                fill_clinic_q=backlog // 3,
+                                fill_imaging_q=backlog // 6,
+                                fill_therapy_q=backlog // 6,
+                                fill_theatre_q=backlog - backlog // 3 - 2 * (backlog // 6),
+                                **params)
+
+
+# benchmark startup (everything up to the first simulated instant after
+# time zero) with bulk and per-patient prefill
+def bench_prefill(sizes=(1_000, 10_000, 100_000), per_patient_max=10_000):
+    print('Startup time for prefilled backlogs')
+    print(f'{"backlog":>10} {"bulk (s)":>10} {"per patient (s)":>16}')
+    for n in sizes:
+        timings = []
+        for bulk_prefill in (True, False):
+            # per patient prefill is quadratic in the backlog, as every
+            # request re-sorts the clinic and theatre queues
+            if not bulk_prefill and n > per_patient_max:
+                timings.append('skipped')
+                continue
+            start = time.perf_counter()
+            model = make_backlog_model(n, bulk_prefill=bulk_prefill)
+            model.start()
+            model.env.run(until=1e-9)
+            timings.append(f'{time.perf_counter() - start:.3f}')
+        print(f'{n:>10} {timings[0]:>10} {timings[1]:>16}')
+
+
+# benchmark the slot engine against simpy, comparing speed and the wait
+# time distribution for default parameters over 1 and 5 year horizons
+def bench_slot(seeds=range(1, 6), durations=(365, 1825)):
+    from scipy.stats import ks_2samp
+
+    print('Slot_Hand_Surgery_Pathway vs Hand_Surgery_Pathway')
+    print(f'{"days":>6} {"simpy (s)":>10} {"slot (s)":>10} {"speedup":>8} '
+          f'{"mean wait":>19} {"end queue":>15} {"KS p":>6}')
+    for sim_duration in durations:
+        timings = {}
+        waits = {}
+        queues = {}
+        for name, engine in [('simpy', Hand_Surgery_Pathway),
+                             ('slot', Slot_Hand_Surgery_Pathway)]:
+            start = time.perf_counter()
+            results = [engine(0, seed=seed, sim_duration=sim_duration).run()
+                       for seed in seeds]
+            timings[name] = (time.perf_counter() - start) / len(seeds)
+            waits[name] = [wait for r in results for wait in r.wait_times.overall_q_time]
+            queues[name] = sum(r.clinic_q + r.imaging_q + r.therapy_q + r.theatre_q
+                               for r in results) / len(results)
+
+        mean_waits = {name: sum(w) / len(w) for name, w in waits.items()}
+        p_value = ks_2samp(waits['simpy'], waits['slot']).pvalue
+        print(f'{sim_duration:>6} {timings["simpy"]:>10.3f} {timings["slot"]:>10.3f} '
+              f'{timings["simpy"] / timings["slot"]:>8.1f} '
+              f'{mean_waits["simpy"]:>9.1f} {mean_waits["slot"]:>9.1f} '
+              f'{queues["simpy"]:>7.0f} {queues["slot"]:>7.0f} {p_value:>6.2f}')
+
+
+# benchmark the batch engine against running the slot engine once per run
+def bench_batch(runs=(100, 1000), slot_runs=50):
+    start = time.perf_counter()
+    for seed in range(slot_runs):
+        Slot_Hand_Surgery_Pathway(0, seed=seed).run()
+    slot_per_run = (time.perf_counter() - start) / slot_runs
+
+    print('Batch_Hand_Surgery_Pathway: replications at default parameters')
+    print(f'{"runs":>6} {"batch (s)":>10} {"slot (s)":>10} {"speedup":>8}')
+    for number_of_runs in runs:
+        start = time.perf_counter()
+        Batch_Hand_Surgery_Pathway(number_of_runs, seed=1).run()
+        elapsed = time.perf_counter() - start
+        slot = slot_per_run * number_of_runs
+        print(f'{number_of_runs:>6} {elapsed:>10.2f} {slot:>10.2f} {slot / elapsed:>8.1f}')
+
+
+# benchmark the overhead of sampling queue lengths every day in simpy runs,
+# in events processed (exact) and run time (best of several repeats,
+# alternating off and on to reduce the effect of timing noise)
+def bench_queue_lengths(seeds=range(1, 4), durations=(100, 1825), repeats=5):
+    print('Hand_Surgery_Pathway.run(): overhead of daily queue length samples')
+    print(f'{"days":>6} {"events off":>11} {"events on":>10} {"extra":>6} '
+          f'{"off (s)":>8} {"on (s)":>8} {"overhead":>9}')
+    for sim_duration in durations:
+        events = {None: 0, 1: 0}
+        timings = {None: float('inf'), 1: float('inf')}
+        for repeat in range(repeats):
+            for interval in timings:
+                elapsed = 0
+                for seed in seeds:
+                    model = Hand_Surgery_Pathway(0, seed=seed, sim_duration=sim_duration,
+                                                 queue_sample_interval=interval)
+                    run_events, run_elapsed = run_counting_events(model)
+                    elapsed += run_elapsed
+                    if repeat == 0:
+                        events[interval] += run_events
+                timings[interval] = min(timings[interval], elapsed / len(seeds))
+        extra = events[1] / events[None] - 1
+        overhead = timings[1] / timings[None] - 1
+        print(f'{sim_duration:>6} {events[None]:>11} {events[1]:>10} {extra:>6.1%} '
+              f'{timings[None]:>8.3f} {timings[1]:>8.3f} {overhead:>8.1%}')
+
+
+# benchmark memory held by the results calculator for many batch engine
+# runs, keeping every wait or only the summary mode sketches
+def bench_sketch(runs=(250, 1000, 2000)):
+    import tracemalloc
+    from ResultsCalculator import Trial_Results_Calculator
+
+    print('Trial_Results_Calculator: memory held after adding runs')
+    print(f'{"runs":>6} {"raw (MB)":>10} {"summary (MB)":>13} {"seconds":>8}')
+    for number_of_runs in runs:
+        row = []
+        for summary_mode in (False, True):
+            calculator = Trial_Results_Calculator(number_of_runs, summary_mode=summary_mode)
+            tracemalloc.start()
+            start = time.perf_counter()
+            for first in range(0, number_of_runs, 250):
+                chunk = Batch_Hand_Surgery_Pathway(min(250, number_of_runs - first), first,
+                                                   seed=first, queue_sample_interval=None)
+                calculator.add_run_results(chunk.run())
+                del chunk
+            elapsed = time.perf_counter() - start
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            row.append(held / 1024 / 1024)
+            del calculator
+        print(f'{number_of_runs:>6} {row[0]:>10.1f} {row[1]:>13.1f} {elapsed:>8.1f}')
+
+
+# benchmark the memory and creation time of patients, and memory and
+# throughput of runs with large prefilled backlogs over days of simulation
+def bench_patients(sizes=(100_000, 1_000_000), backlogs=(10_000, 100_000), days=365):
+    import tracemalloc
+
+    print('Patient: memory and creation time')
+    print(f'{"patients":>10} {"bytes/patient":>14} {"us/patient":>11}')
+    for n in sizes:
+        start = time.perf_counter()
+        patients = [Patient(i) for i in range(n)]
+        elapsed = time.perf_counter() - start
+        del patients
+
+        tracemalloc.start()
+        patients = [Patient(i) for i in range(n)]
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del patients
+        print(f'{n:>10} {held / n:>14.0f} {elapsed / n * 1e6:>11.2f}')
+
+    print(f'Hand_Surgery_Pathway: first {days} days with a large backlog')
+    print(f'{"backlog":>10} {"events":>8} {"seconds":>8} {"events/s":>10} {"peak MB":>8}')
+    for backlog in backlogs:
+        model = make_backlog_model(backlog, sim_duration=days)
+        model.start()
+        events, elapsed = run_counting_events_until(model, days)
+
+        tracemalloc.start()
+        model = make_backlog_model(backlog, sim_duration=days)
+        model.start()
+        model.env.run(until=days)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{backlog:>10} {events:>8} {elapsed:>8.2f} {events / elapsed:>10.0f} '
+              f'{peak / 1024 / 1024:>8.1f}')
+
+
+# function to run a started model until a time, counting the events
+def run_counting_events_until(model, until):
+    env = model.env
+    step = env.step
+    events = 0
+
+    def counting_step():
+        nonlocal events
+        events += 1
+        step()
+
+    env.step = counting_step
+    start = time.perf_counter()
+    env.run(until=until)
+    return events, time.perf_counter() - start
+
+
+# benchmark where the time of a run at default parameters goes, by phase,
+# writing a cProfile dump of the first run to profile_path
+def bench_profile(seeds=(1, 2, 3), profile_path='run.prof'):
+    from RunProfiler import Run_Profiler
+
+    print('Hand_Surgery_Pathway.run(): time and events by phase at default parameters')
+    print(f'{"seed":>6} {"events":>8} {"events/s":>9} {"prefill":>8} {"main":>8} '
+          f'{"drain":>8} {"results":>8} {"peak pts":>9} {"peak MB":>8}')
+    for seed in seeds:
+        profiler = Run_Profiler(memory=True,
+                                profile_path=profile_path if seed == seeds[0] else None)
+        Hand_Surgery_Pathway(0, seed=seed).run(profiler)
+        report = profiler.report
+        phases = report['phase_seconds']
+        print(f'{seed:>6} {report["events"]:>8} {report["events_per_second"]:>9.0f} '
+              f'{phases["prefill"]:>8.3f} {phases["main_loop"]:>8.3f} '
+              f'{phases["drain"]:>8.3f} {phases["results"]:>8.3f} '
+              f'{report["peak_patients"]:>9} {report["peak_memory_bytes"] / 1024 / 1024:>8.1f}')
+    print(f'cProfile dump of seed {seeds[0]} written to {profile_path}')
+
+
+# benchmark the confidence interval of differences between scenarios, from
+# independent runs (different seeds), and from runs paired by run number
+# with the same seeds, with and without common random numbers. Runs needed
+# for the same precision scale with the half width squared
+def bench_crn(number_of_runs=30, sim_duration=365, measures=('total_q', 'wait_time_end')):
+    from scipy.stats import t
+    from ResultsCalculator import Trial_Results_Calculator
+    from TrialRunner import Trial_Runner
+
+    def trial(master_seed, **params):
+        calculator = Trial_Results_Calculator(number_of_runs, sim_duration=sim_duration)
+        calculator.add_run_results(Trial_Runner(number_of_runs, master_seed, max_workers=1,
+                                                engine='slot', sim_duration=sim_duration,
+                                                **params).run_trial())
+        return calculator
+
+    comparisons = {'2 extra patients per trauma list': {'trauma_extra_patients': 2},
+                   'half the clinic backlog': {'fill_clinic_q': 300}}
+
+    print(f'Paired differences between scenarios: {number_of_runs} slot engine runs each')
+    print(f'{"comparison":>33} {"measure":>14} {"difference":>11} '
+          f'{"independent":>12} {"paired":>8} {"paired CRN":>11} {"runs saved":>11}')
+    for name, params in comparisons.items():
+        independent = trial(2, **params).running_stats, trial(1).running_stats
+        paired = trial(1, **params).paired_difference(trial(1))
+        crn = trial(1, common_random_numbers=True, **params).paired_difference(
+            trial(1, common_random_numbers=True))
+
+        for measure in measures:
+            scenario, baseline = independent[0][measure], independent[1][measure]
+            t_value = t.ppf(0.975, scenario.count + baseline.count - 2)
+            unpaired = t_value * (scenario.variance() / scenario.count +
+                                  baseline.variance() / baseline.count) ** 0.5
+            paired_width = (paired.loc[measure, 'upper'] - paired.loc[measure, 'lower']) / 2
+            crn_width = (crn.loc[measure, 'upper'] - crn.loc[measure, 'lower']) / 2
+            print(f'{name:>33} {measure:>14} {crn.loc[measure, "difference"]:>11.1f} '
+                  f'{unpaired:>12.1f} {paired_width:>8.1f} {crn_width:>11.1f} '
+                  f'{(unpaired / crn_width) ** 2:>10.1f}x')
+
+
+# benchmark running until results are precise, checking each run yielded
+# is added to the results once
+def bench_adaptive(max_runs=40, sim_duration=365, relative_tolerance=0.25):
+    from ResultsCalculator import Trial_Results_Calculator
+    from TrialRunner import Trial_Runner
+
+    print(f'Trial_Results_Calculator.add_runs_until_precise: up to {max_runs} slot engine runs, '
+          f'{relative_tolerance:.0%} tolerance')
+    print(f'{"stop at horizon":>16} {"yielded":>8} {"results":>8} {"seconds":>8} {"stopped for":>12} '
+          f'{"left out":>30}')
+    for stop_at_horizon in (False, True):
+        calculator = Trial_Results_Calculator(max_runs, sim_duration=sim_duration)
+        runner = Trial_Runner(max_runs, 1, max_workers=1, engine='slot',
+                              sim_duration=sim_duration, stop_at_horizon=stop_at_horizon)
+        start = time.perf_counter()
+        yielded = sum(1 for results in calculator.add_runs_until_precise(
+            runner, relative_tolerance=relative_tolerance))
+        elapsed = time.perf_counter() - start
+        print(f'{str(stop_at_horizon):>16} {yielded:>8} {len(calculator.run_results):>8} '
+              f'{elapsed:>8.2f} {calculator.stopping_reason:>12} '
+              f'{", ".join(calculator.unmeasured_precision_measures()) or "-":>30}')
+        if len(calculator.run_results) != yielded:
+            raise RuntimeError(f'{len(calculator.run_results)} runs added for {yielded} yielded')
+
+
+# benchmark the analytic engine against the simulation over a grid of
+# scenarios - queue sizes at sim_duration (from runs stopped there) and
+# the mean wait of all referrals (from complete runs)
+def bench_analytic(number_of_runs=5, sim_duration=365, engine='simpy',
+                   grid={'referrals_per_week': [8, 12],
+                         'theatre_list_per_week': [2, 4],
+                         'fill_clinic_q': [0, 600]}):
+    from AnalyticPathway import Analytic_Hand_Surgery_Pathway
+    from ParameterSweep import Parameter_Sweep, parameter_grid
+
+    scenarios = parameter_grid(grid)
+    at_horizon = Parameter_Sweep(number_of_runs, 1, engine=engine, sim_duration=sim_duration,
+                                 stop_at_horizon=True).run(scenarios)
+    complete = Parameter_Sweep(number_of_runs, 1, engine=engine,
+                               sim_duration=sim_duration).run(scenarios)
+    names = list(grid)
+
+    print(f'Analytic_Hand_Surgery_Pathway vs {engine} ({number_of_runs} runs, '
+          f'{sim_duration} days)')
+    print(f'{" ".join(f"{name[:12]:>12}" for name in names)} {"ms":>5} '
+          f'{"queue":>7} {"sim":>7} {"error":>7} {"wait":>7} {"sim":>7} {"error":>7}')
+    errors = {'queue': [], 'wait': []}
+    for params in scenarios:
+        start = time.perf_counter()
+        projection = Analytic_Hand_Surgery_Pathway(0, sim_duration=sim_duration,
+                                                   **params).project()
+        elapsed = time.perf_counter() - start
+        queue, wait = projection['total_q'], statistics.fmean(projection['waits'])
+
+        def matching(table):
+            return table[(table[names] == pd.Series(params)).all(axis=1)]
+        sim_queue = matching(at_horizon)['total_q'].mean()
+        sim_wait = matching(complete)['mean_wait'].mean()
+
+        errors['queue'].append(abs(queue - sim_queue) / max(sim_queue, 1))
+        errors['wait'].append(abs(wait - sim_wait) / sim_wait)
+        print(f'{" ".join(f"{params[name]:>12}" for name in names)} {elapsed * 1000:>5.0f} '
+              f'{queue:>7.0f} {sim_queue:>7.0f} {errors["queue"][-1]:>7.1%} '
+              f'{wait:>7.1f} {sim_wait:>7.1f} {errors["wait"][-1]:>7.1%}')
+    print(f'median error: queue {statistics.median(errors["queue"]):.1%}, '
+          f'wait {statistics.median(errors["wait"]):.1%}')
+
+
+# benchmark branching policy variants from a snapshot of a warmed up run,
+# against simulating the shared warm up again for each, and check that a
+# snapshot restored unchanged finishes exactly as the run would have
+def bench_checkpoint(sim_duration=1825, warm_up=1460, seeds=(1, 2),
+                     variants=({}, {'theatre_list_per_week': 3},
+                               {'trauma_extra_patients': 2},
+                               {'surg_clinic_per_week': 3, 'theatre_list_per_week': 3})):
+    import pickle
+    from Checkpoint import Pathway_Snapshot
+
+    params = {'sim_duration': sim_duration, 'stop_at_horizon': True}
+
+    print(f'Pathway_Snapshot: {len(variants)} variants branched at day {warm_up} '
+          f'of {sim_duration}')
+    print(f'{"seed":>6} {"warm up s":>10} {"capture ms":>11} {"size MB":>8} '
+          f'{"restore ms":>11} {"branched s":>11} {"rerun s":>8} {"exact":>6}')
+    for seed in seeds:
+        start = time.perf_counter()
+        model = Hand_Surgery_Pathway(0, seed=seed, **params)
+        model.run_until(warm_up)
+        warmed = time.perf_counter()
+        warm_up_time = warmed - start
+        snapshot = Pathway_Snapshot.capture(model)
+        captured = time.perf_counter()
+        size = len(pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+
+        restore_times = []
+        for overrides in variants:
+            restoring = time.perf_counter()
+            branch = snapshot.restore(**overrides)
+            restore_times.append(time.perf_counter() - restoring)
+            branch.finish()
+        branched = time.perf_counter() - start
+
+        # the same variants, each simulating the warm up again
+        start = time.perf_counter()
+        for overrides in variants:
+            model = Hand_Surgery_Pathway(0, seed=seed, **params)
+            model.run_until(warm_up)
+            Pathway_Snapshot.capture(model).restore(**overrides).finish()
+        rerun = time.perf_counter() - start
+
+        full = Hand_Surgery_Pathway(0, seed=seed, **params).run()
+        restored = snapshot.restore().finish()
+        exact = (full.wait_times_df().equals(restored.wait_times_df())
+                 and full.queue_lengths_df().equals(restored.queue_lengths_df())
+                 and full.censored_waits_df().equals(restored.censored_waits_df()))
+
+        print(f'{seed:>6} {warm_up_time:>10.3f} {(captured - warmed) * 1000:>11.1f} '
+              f'{size / 1024 / 1024:>8.2f} {statistics.fmean(restore_times) * 1000:>11.1f} '
+              f'{branched:>11.2f} {rerun:>8.2f} {str(exact):>6}')
+
+
+# benchmark booking patients into sessions compiled from a schedule (one
+# with a closure after the run, so nothing else changes) against clinics
+# and lists opening and closing as processes, and check an empty schedule
+# runs as no schedule and the simpy and slot engines agree on waits under
+# a schedule
+def bench_schedule(sim_duration=1825, seeds=(1, 2, 3),
+                   schedule={'changes': [{'day': 270, 'referrals_per_week': 14},
+                                         {'day': 330, 'referrals_per_week': 10}],
+                             'closures': [{'start': day, 'end': day + 4}
+                                          for day in range(357, 1825, 365)]}):
+    print(f'Hand_Surgery_Pathway: sessions as processes vs compiled from a schedule, '
+          f'{sim_duration} days')
+    booked = {'closures': [{'start': 2 * sim_duration, 'end': 2 * sim_duration + 1}]}
+    print(f'{"seed":>6} {"events":>15} {"seconds":>15} {"empty as none":>14} '
+          f'{"slot waits match":>17}')
+    for seed in seeds:
+        events, elapsed = zip(*[run_counting_events(Hand_Surgery_Pathway(
+            0, seed=seed, sim_duration=sim_duration, schedule=plan)) for plan in (None, booked)])
+
+        unscheduled, empty = [Hand_Surgery_Pathway(0, seed=seed, sim_duration=sim_duration,
+                                                   schedule=plan).run()
+                              for plan in (None, {})]
+        empty_as_none = (unscheduled.wait_times_df().equals(empty.wait_times_df())
+                         and unscheduled.queue_numbers_row() == empty.queue_numbers_row())
+
+        waits = [sorted(engine(0, seed=seed, sim_duration=sim_duration, schedule=schedule)
+                        .run().wait_times.overall_q_time)
+                 for engine in (Hand_Surgery_Pathway, Slot_Hand_Surgery_Pathway)]
+        print(f'{seed:>6} {events[0]:>7} {events[1]:>7} {elapsed[0]:>7.3f} {elapsed[1]:>7.3f} '
+              f'{str(empty_as_none):>14} {str(waits[0] == waits[1]):>17}')
+
+
+# modules that simulation workers and headless runs import, which should
+# only need simpy and the standard library
+core_modules = ['global_params', 'HandPatient', 'HandPathway', 'SlotPathway',
+                'ResultsRecorder', 'RunningStats', 'TrialRunner', 'ResultsCache',
+                'ResultsCalculator', 'ParameterSweep', 'RunProfiler', 'AnalyticPathway',
+                'Checkpoint', 'Schedule']
+heavy_packages = {'numpy', 'pandas', 'scipy', 'statsmodels', 'plotly',
+                  'matplotlib', 'seaborn', 'PIL', 'streamlit'}
+
+
+# benchmark the import time of each core module in a fresh interpreter, with
+# python -X importtime, failing if any of them imports a heavy package
+def bench_imports(modules=core_modules):
+    content = os.path.dirname(os.path.abspath(__file__))
+    check = ('import sys, {module}; '
+             'print(*sorted({{name.split(".")[0] for name in sys.modules}} & {heavy}))')
+
+    print('Import time of core modules in a fresh interpreter')
+    print(f'{"module":>18} {"ms":>8}  heavy packages imported')
+    failures = []
+    for module in modules:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                cwd=content, capture_output=True, text=True, check=True)
+        # the last line is the module itself, with its cumulative time in us
+        cumulative = int(result.stderr.strip().splitlines()[-1].split('|')[1])
+
+        heavy = subprocess.run([sys.executable, '-c',
+                                check.format(module=module, heavy=heavy_packages)],
+                               cwd=content, capture_output=True, text=True,
+                               check=True).stdout.strip()
+        if heavy:
+            failures.append(module)
+        print(f'{module:>18} {cumulative / 1000:>8.1f}  {heavy or "-"}')
+
+    if failures:
+        sys.exit(f'Heavy packages imported by {", ".join(failures)}')
+
+
+# cases of the reproducible benchmark suite. Each runs with a fixed seed and
+# returns the seconds taken by the part being measured, and counts (events,
+# patients, rows) that only change when the model does. Runs with 10 times
+# the referrals or prefill backlog take minutes to drain, as every request
+# re-sorts the clinic and theatre queues, so those run to a fixed horizon
+suite_seed = 1
+suite_horizon = 365
+
+
+def case_default_run():
+    model = Hand_Surgery_Pathway(0, seed=suite_seed)
+    events, elapsed = run_counting_events(model)
+    return elapsed, {'events': events, 'patients': model.patient_counter}
+
+
+def case_referrals_10x():
+    model = Hand_Surgery_Pathway(0, seed=suite_seed, referrals_per_week=100)
+    model.start()
+    events, elapsed = run_counting_events_until(model, suite_horizon)
+    return elapsed, {'events': events, 'patients': model.patient_counter}
+
+
+def case_prefill_10x():
+    start = time.perf_counter()
+    model = make_backlog_model(18_000)
+    model.start()
+    setup = time.perf_counter() - start
+    events, elapsed = run_counting_events_until(model, suite_horizon)
+    return setup + elapsed, {'events': events, 'patients': model.patient_counter}
+
+
+def case_five_year():
+    model = Hand_Surgery_Pathway(0, seed=suite_seed, sim_duration=1825)
+    events, elapsed = run_counting_events(model)
+    return elapsed, {'events': events, 'patients': model.patient_counter}
+
+
+# function to import the packages results are plotted with, so their
+# import time is not counted in the first repeat
+def warm_plotting_imports():
+    for module in ('plotly.express', 'plotly.graph_objects', 'statsmodels.api'):
+        importlib.import_module(module)
+
+
+def case_trial():
+    from ResultsCalculator import Trial_Results_Calculator
+    from TrialRunner import Trial_Runner
+    warm_plotting_imports()
+
+    start = time.perf_counter()
+    calculator = Trial_Results_Calculator(5)
+    calculator.add_run_results(Trial_Runner(5, suite_seed, max_workers=1).run_trial())
+    calculator.concatenate_wait_times()
+    calculator.calculate_mean_queue_numbers()
+    calculator.readout_total_queue_numbers()
+    calculator.readout_wait_time_start()
+    calculator.readout_wait_time_end()
+    calculator.plot_wait_times()
+    calculator.plot_queue_numbers()
+    elapsed = time.perf_counter() - start
+    return elapsed, {'rows': len(calculator.all_wait_times_df)}
+
+
+def case_aggregation(number_of_runs=250, sim_duration=1825):
+    from ResultsCalculator import Trial_Results_Calculator
+
+    warm_plotting_imports()
+
+    # a large trial from the batch engine, not timed
+    calculator = Trial_Results_Calculator(number_of_runs, sim_duration=sim_duration)
+    calculator.add_run_results(Batch_Hand_Surgery_Pathway(
+        number_of_runs, seed=suite_seed, sim_duration=sim_duration).run())
+
+    start = time.perf_counter()
+    calculator.concatenate_wait_times()
+    calculator.calculate_mean_queue_numbers()
+    calculator.calculate_queue_length_bands()
+    calculator.readout_wait_time_start()
+    calculator.readout_wait_time_end()
+    calculator.plot_wait_times()
+    calculator.plot_queue_numbers()
+    calculator.plot_queue_lengths()
+    elapsed = time.perf_counter() - start
+    return elapsed, {'rows': len(calculator.all_wait_times_df),
+                     'queue_length_rows': len(calculator.queue_lengths_df)}
+
+
+suite_cases = {
+    'default_run': case_default_run,
+    'referrals_10x': case_referrals_10x,
+    'prefill_10x': case_prefill_10x,
+    'five_year': case_five_year,
+    'trial': case_trial,
+    'aggregation': case_aggregation,
+}
+
+
+# function to run the suite cases, each repeats times, returning the best
+# and median seconds and the counts of each
+def run_suite(cases, repeats):
+    results = {}
+    for name in cases:
+        timings = []
+        for repeat in range(repeats):
+            elapsed, counts = suite_cases[name]()
+            timings.append(elapsed)
+        results[name] = {'best': min(timings), 'median': statistics.median(timings),
+                         'counts': counts}
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'repeats': repeats, 'seed': suite_seed, 'cases': results}
+
+
+# benchmark the suite, printing results and comparing them with a baseline
+# saved earlier, if given. A case regresses if its best time is slower than
+# the baseline's by more than tolerance, or its counts have changed
+def bench_suite(cases=None, repeats=3, save=None, compare=None, tolerance=0.25):
+    baseline = None
+    if compare is not None:
+        with open(compare) as f:
+            baseline = json.load(f)['cases']
+
+    print(f'Benchmark suite: best and median of {repeats} repeats, seed {suite_seed}')
+    print(f'{"case":>14} {"best (s)":>9} {"median (s)":>11} {"baseline (s)":>13} '
+          f'{"change":>8}  counts')
+    suite = run_suite(cases or suite_cases, repeats)
+    regressions = []
+    for name, result in suite['cases'].items():
+        counts = ', '.join(f'{key} {value}' for key, value in result['counts'].items())
+        previous = baseline.get(name) if baseline else None
+        if previous is None:
+            print(f'{name:>14} {result["best"]:>9.3f} {result["median"]:>11.3f} '
+                  f'{"-":>13} {"-":>8}  {counts}')
+            continue
+
+        change = result['best'] / previous['best'] - 1
+        flags = []
+        if change > tolerance:
+            flags.append('SLOWER')
+        if result['counts'] != previous['counts']:
+            flags.append(f'counts were {previous["counts"]}')
+        if flags:
+            regressions.append(name)
+        print(f'{name:>14} {result["best"]:>9.3f} {result["median"]:>11.3f} '
+              f'{previous["best"]:>13.3f} {change:>8.1%}  {counts} {" ".join(flags)}')
+
+    if save is not None:
+        with open(save, 'w') as f:
+            json.dump(suite, f, indent=2)
+        print(f'Results saved to {save}')
+    if regressions:
+        sys.exit(f'Regressions against {compare}: {", ".join(regressions)}')
+
+
+benchmarks = {
+    'recorder': bench_recorder,
+    'concat': bench_concat,
+    'events': bench_events,
+    'prefill': bench_prefill,
+    'slot': bench_slot,
+    'batch': bench_batch,
+    'queue_lengths': bench_queue_lengths,
+    'sketch': bench_sketch,
+    'imports': bench_imports,
+    'patients': bench_patients,
+    'profile': bench_profile,
+    'crn': bench_crn,
+    'adaptive': bench_adaptive,
+    'analytic': bench_analytic,
+    'checkpoint': bench_checkpoint,
+    'schedule': bench_schedule,
+    'suite': bench_suite,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run simulation benchmarks')
+    parser.add_argument('names', nargs='*',
+                        help=f'benchmarks to run: {", ".join(benchmarks)} (default: all)')
+    parser.add_argument('--cases', nargs='+', choices=list(suite_cases),
+                        help='suite cases to run (default: all)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='times to repeat each suite case')
+    parser.add_argument('--save', help='save suite results as a JSON baseline')
+    parser.add_argument('--compare', help='compare suite results with a JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown against the baseline counted as a regression')
+    args = parser.parse_args()
+
+    unknown = set(args.names) - set(benchmarks)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    for name in args.names or benchmarks:
+        if name == 'suite':
+            bench_suite(args.cases, args.repeats, args.save, args.compare, args.tolerance)
+        else:
+            benchmarks[name]()
+        print()
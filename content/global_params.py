@@ -35,6 +35,66 @@ class g:
     fill_imaging_q = 300
     fill_therapy_q = 300
     fill_theatre_q = 600
+
+    #seed prefilled queues in one step rather than one process per patient
+    bulk_prefill = True
     
+    #stop each run at sim_duration, recording waits of patients still in
+    #the pathway as censored, instead of seeing every patient referred
+    #before then through theatres
+    stop_at_horizon = False
+
+    #draw referral times and routing from separate streams, so scenarios
+    #run with the same seeds see the same referrals and can be compared
+    #run by run
+    common_random_numbers = False
+
+    #schedule of changes to capacity and demand part way through a run
+    #and closures of stages (see Schedule.Pathway_Schedule), or None
+    schedule = None
+
+    #days between samples of the numbers in each queue (None to not
+    #sample), and samples kept per run before halving them
+    queue_sample_interval = 1
+    queue_max_samples = 2048
+
     #number of times to run simulation
-    number_of_runs = 5
\ No newline at end of file
+    number_of_runs = 5
+
+    #summary mode - wait time sketches by bucket of referral days, to
+    #within a relative accuracy, and the 18 week referral to treatment
+    #target (days)
+    sketch_bucket_days = 1
+    sketch_relative_accuracy = 0.01
+    breach_days = 126
+
+    #when running until results are precise - target confidence interval
+    #half width relative to the mean, and budget of runs and seconds
+    adaptive_tolerance = 0.1
+    adaptive_min_runs = 5
+    adaptive_max_runs = 200
+    adaptive_max_seconds = 120
+
+    #simulation backend - 'simpy', 'slot' for the faster slot engine, or
+    #'batch' to simulate many runs at once as numpy arrays
+    engine = 'simpy'
+
+    #replications simulated together by the batch engine
+    batch_chunk_size = 250
+
+    #wait time plot - 'scatter' of every patient, 'binned' quantile bands
+    #by referral day, 'sample' of at most wait_plot_max_points patients,
+    #or 'auto' to bin when there are more patients than that
+    wait_plot_mode = 'auto'
+    wait_plot_max_points = 5000
+    wait_plot_bins = 100
+
+    #redraw results in the webapp every this many completed runs
+    stream_update_every = 1
+
+    #seed from which the seed of each run is derived
+    master_seed = 42
+
+    #file storing results of previous trials, and its size limit
+    results_cache_path = 'results_cache.sqlite'
+    results_cache_max_megabytes = 500
@@ -1,23 +1,16 @@
 # Models the elective hand surgery pathway at GSTT
 # A Streamlit webapp built using Simpy
 
-import simpy
-import random
-import numpy as np
-import pandas as pd
-import csv
-from statistics import mean
-import matplotlib.pyplot as plt
-import seaborn as sns
-import os
+import json
+
 import streamlit as st
-import plotly.express as px
 
-from HandPatient import Patient
-from HandPathway import Hand_Surgery_Pathway
+from AnalyticPathway import Analytic_Hand_Surgery_Pathway
+from ResultsCache import Results_Cache, cache_key
 from ResultsCalculator import Trial_Results_Calculator
+from Schedule import Pathway_Schedule, schedule_parameters
+from TrialRunner import Trial_Runner
 from global_params import g
-from PIL import Image
 
 # page config
 st.set_page_config(layout='wide')
@@ -35,8 +28,7 @@ st.markdown('[Source code](https://github.com/gasman-dom/gstt_hands_waitlist_st)
 
 # image of pathway
 
-image = Image.open('./content/pathway_diagram.jpg')
-st.image(image,use_column_width=True)
+st.image('./content/pathway_diagram.jpg',use_column_width=True)
 
 # set up columns
 col1, col2, col3, col4, col5 = st.columns(5)
@@ -107,61 +99,163 @@ with col5:
                                         step = 1,
                                         value = g.trauma_extra_patients)
 
-NUM_OF_RUNS = st.number_input('Number of Times to Run Simulation',
-                                        step = 1,   
-                                        value = g.number_of_runs)
-st.markdown('Repeating the simulation more times will provide more reliable results, but will take longer to run.')
+ADAPTIVE = st.checkbox('Keep running the simulation until results are precise')
+
+if ADAPTIVE:
+    TOLERANCE = st.number_input('Target Precision (% either side of the average)',
+                                step = 1,
+                                value = round(g.adaptive_tolerance * 100))
+    NUM_OF_RUNS = st.number_input('Maximum Number of Times to Run Simulation',
+                                  step = 1,
+                                  value = g.adaptive_max_runs)
+    st.markdown('The simulation is repeated until the 95% confidence intervals of the waiting list size and waiting times are within the target precision, or the maximum number of runs is reached.')
+else:
+    NUM_OF_RUNS = st.number_input('Number of Times to Run Simulation',
+                                            step = 1,   
+                                            value = g.number_of_runs)
+    st.markdown('Repeating the simulation more times will provide more reliable results, but will take longer to run.')
 
 LENGTH_OF_SIM = st.number_input('Length of Time to Simulate (days)',
                                         step = 1,
                                         value = g.sim_duration)
 
+STOP_AT_HORIZON = st.checkbox('Stop at the end of the simulated time, estimating the waits of patients still waiting')
+
+SUMMARY_MODE = st.checkbox('Summarise waiting times as the simulation runs (for large numbers of runs)')
+
+SCHEDULE = st.text_area('Changes part way through the simulation and closures (optional)',
+                        placeholder='{"changes": [{"day": 90, "referrals_per_week": 15}, {"day": 150, "referrals_per_week": 10}], '
+                                    '"closures": [{"start": 84, "end": 85}, {"start": 200, "end": 207, "stages": ["theatres"]}]}')
+st.markdown('Each change sets new values from its day onwards of referrals_per_week, surg_clinic_per_week, surg_clinic_appts, imaging_weekly_appts, '
+            'therapy_weekly_appts, theatre_list_per_week, theatre_list_capacity, trauma_list_per_week or trauma_extra_patients. '
+            'Each closure closes the clinic, imaging, therapy and/or theatres (all of them if not given) from its start day to its end day.')
+
 #calculate total in queues at start of simulation
 TOTAL_Q_START = CLINIC_Q + IMAGING_Q + THERAPY_Q + THEATRE_Q
 
 # button to run simulation
 if st.button('Start Simulation'):
 
-    # spinner while loading
-    with st.spinner('Running simulation...'):
-
-        # create a file to store the numbers in queues
-        with open('queue_numbers.csv', 'w') as csvfile:
-            writer = csv.writer(csvfile, delimiter=',')
-            writer.writerow(['run','clinic_q', 'imaging_q', 'therapy_q', 'theatres_q'])
-
-        # For the number of runs specified in the g class, create an instance of the
-        # ED_Model class, and call its run method
-        for run in range(g.number_of_runs):
-            print (f"Run {run+1} of {g.number_of_runs}")
-            demo_pathway_model = Hand_Surgery_Pathway(run,
-                                                      referrals_per_week=REFS_PER_WEEK,
-                                                      surg_clinic_per_week=CLINICS_PER_WEEK,
-                                                      surg_clinic_appts=CLINIC_APPTS,
-                                                      fill_clinic_q=CLINIC_Q,
-                                                      imaging_weekly_appts=IMAGING_WEEKLY_APPTS,
-                                                      prob_needs_imaging=PROB_IMAGING,
-                                                      fill_imaging_q=IMAGING_Q,
-                                                      therapy_weekly_appts=THERAPY_WEEKLY_APPTS,
-                                                      prob_needs_therapy=PROB_THERAPY,
-                                                      fill_therapy_q=THERAPY_Q,
-                                                      theatre_list_per_week=LISTS_PER_WEEK,
-                                                      theatre_list_capacity=LIST_CAPACITY,
-                                                      trauma_list_per_week=TRAUMA_LISTS,
-                                                      trauma_extra_patients=EXTRA_PATIENTS,
-                                                      fill_theatre_q=THEATRE_Q,
-                                                      sim_duration=LENGTH_OF_SIM
-                                                      )
-            demo_pathway_model.run()
-
-        # Once the trial is complete, we'll create an instance of the
-        # Trial_Result_Calculator class and run the print_trial_results method
-        demo_trial_results_calculator = Trial_Results_Calculator(number_of_runs=NUM_OF_RUNS,
-                                                                 sim_duration=LENGTH_OF_SIM,
-                                                                 fill_clinic_q=CLINIC_Q,
-                                                                 fill_imaging_q=IMAGING_Q,
-                                                                 fill_therapy_q=THERAPY_Q,
-                                                                 fill_theatre_q=THEATRE_Q)
+    try:
+        schedule = json.loads(SCHEDULE) if SCHEDULE.strip() else None
+    except json.JSONDecodeError as error:
+        st.error(f'The changes and closures could not be read: {error}')
+        st.stop()
+
+    # Run the simulation NUM_OF_RUNS times, spread across processes, with
+    # each run seeded from the master seed so results are reproducible.
+    # Results are kept in the results cache, so a scenario that has been
+    # run before is read back instead of being run again
+    params = dict(referrals_per_week=REFS_PER_WEEK,
+                  surg_clinic_per_week=CLINICS_PER_WEEK,
+                  surg_clinic_appts=CLINIC_APPTS,
+                  fill_clinic_q=CLINIC_Q,
+                  imaging_weekly_appts=IMAGING_WEEKLY_APPTS,
+                  prob_needs_imaging=PROB_IMAGING,
+                  fill_imaging_q=IMAGING_Q,
+                  therapy_weekly_appts=THERAPY_WEEKLY_APPTS,
+                  prob_needs_therapy=PROB_THERAPY,
+                  fill_therapy_q=THERAPY_Q,
+                  theatre_list_per_week=LISTS_PER_WEEK,
+                  theatre_list_capacity=LIST_CAPACITY,
+                  trauma_list_per_week=TRAUMA_LISTS,
+                  trauma_extra_patients=EXTRA_PATIENTS,
+                  fill_theatre_q=THEATRE_Q,
+                  sim_duration=LENGTH_OF_SIM,
+                  stop_at_horizon=STOP_AT_HORIZON,
+                  schedule=schedule)
+
+    # compile the schedule once here, so a mistake in it is shown rather
+    # than raised in every run
+    if schedule is not None:
+        try:
+            Pathway_Schedule(schedule, {name: params[name] for name in schedule_parameters})
+        except (KeyError, ValueError, TypeError) as error:
+            missing = 'missing ' if isinstance(error, KeyError) else ''
+            st.error(f'The changes and closures could not be used: {missing}{error}')
+            st.stop()
+    # an instant estimate from the average rate of each stage, shown while
+    # the simulation runs - average rates do not allow for changes part way
+    # through
+    st.session_state.pop('projection', None)
+    if schedule is None:
+        projection = Analytic_Hand_Surgery_Pathway(0, **params).project()
+        st.session_state['projection'] = projection
+        st.subheader('Instant Estimate')
+        st.text(f'From average appointment rates alone, the total number of patients on the waiting list after {LENGTH_OF_SIM} days is estimated to be {round(projection["total_q"])}, '
+                f'and patients referred on the last day to wait {round(projection["wait_time_end"])} days for surgery. The simulation below gives the full picture.')
+        st.line_chart(Analytic_Hand_Surgery_Pathway.queues_df(projection))
+
+    demo_trial_runner = Trial_Runner(number_of_runs=NUM_OF_RUNS,
+                                     master_seed=g.master_seed,
+                                     **params)
+    results_cache = Results_Cache()
+    key = cache_key(params, NUM_OF_RUNS, g.master_seed, demo_trial_runner.engine)
+
+    # the Trial_Results_Calculator takes each run's results as it completes,
+    # and is kept in the session state so results so far are still shown
+    # if the simulation is stopped
+    demo_trial_results_calculator = Trial_Results_Calculator(number_of_runs=NUM_OF_RUNS,
+                                                             sim_duration=LENGTH_OF_SIM,
+                                                             fill_clinic_q=CLINIC_Q,
+                                                             fill_imaging_q=IMAGING_Q,
+                                                             fill_therapy_q=THERAPY_Q,
+                                                             fill_theatre_q=THEATRE_Q,
+                                                             summary_mode=SUMMARY_MODE)
+    st.session_state['calculator'] = demo_trial_results_calculator
+    st.session_state['total_q_start'] = TOTAL_Q_START
+    st.session_state['stop_at_horizon'] = STOP_AT_HORIZON
+
+    # runs until precise depend on when runs complete, so are not cached
+    run_results = None if ADAPTIVE else results_cache.get(key)
+
+    # show how often scenarios are read from the results cache - read again
+    # once this scenario's results are stored, unless it is stopped first
+    st.session_state['cache_stats'] = results_cache.stats()
+    st.session_state['adaptive'] = ADAPTIVE
+
+    if run_results is not None:
+        demo_trial_results_calculator.add_run_results(run_results)
+    else:
+        # pressing stop reruns the script, which ends this loop
+        st.button('Stop Simulation')
+        progress = st.progress(0.0)
+        estimates = st.empty()
+        queue_chart = st.empty()
+
+        # both add each run to the calculator before yielding it
+        if ADAPTIVE:
+            runs = demo_trial_results_calculator.add_runs_until_precise(
+                demo_trial_runner, relative_tolerance=TOLERANCE / 100)
+        else:
+            runs = demo_trial_results_calculator.add_runs(demo_trial_runner)
+
+        for results in runs:
+            runs_done = len(demo_trial_results_calculator.run_results)
+
+            # redraw the running estimates every few runs
+            if runs_done % g.stream_update_every == 0 or runs_done == NUM_OF_RUNS:
+                progress.progress(runs_done / NUM_OF_RUNS,
+                                  text=f'{runs_done} of {NUM_OF_RUNS} runs complete')
+                estimates.dataframe(demo_trial_results_calculator.running_estimates().round(1))
+                demo_trial_results_calculator.calculate_mean_queue_numbers()
+                queue_chart.plotly_chart(demo_trial_results_calculator.plot_queue_numbers())
+
+        progress.empty()
+        estimates.empty()
+        queue_chart.empty()
+        # summary mode does not keep each run's waits, so is not cached
+        if not ADAPTIVE and not SUMMARY_MODE:
+            results_cache.put(key, sorted(demo_trial_results_calculator.run_results,
+                                          key=lambda results: results.run_number))
+            st.session_state['cache_stats'] = results_cache.stats()
+
+# show the results of the last simulation, complete or stopped early
+if 'calculator' in st.session_state:
+    demo_trial_results_calculator = st.session_state['calculator']
+    runs_done = len(demo_trial_results_calculator.run_results)
+
+    if runs_done > 0:
         demo_trial_results_calculator.concatenate_wait_times()
         demo_trial_results_calculator.calculate_mean_queue_numbers()
 
@@ -174,16 +268,97 @@ if st.button('Start Simulation'):
 
         # print results
         st.header('Results')
+        if st.session_state['adaptive']:
+            stopping_reason = demo_trial_results_calculator.stopping_reason
+            if stopping_reason == 'precision':
+                st.success(f'Results reached the target precision after {runs_done} runs.')
+            elif stopping_reason == 'max_runs':
+                st.warning(f'Results did not reach the target precision within {runs_done} runs.')
+            elif stopping_reason == 'time':
+                st.warning(f'Results did not reach the target precision within the time limit ({runs_done} runs).')
+            else:
+                st.warning(f'Simulation stopped early - results are from {runs_done} runs.')
+            unmeasured = demo_trial_results_calculator.unmeasured_precision_measures()
+            if unmeasured:
+                st.info(f'No run had a value for {", ".join(unmeasured)}, so precision was judged without '
+                        f'{"it" if len(unmeasured) == 1 else "them"} - with the simulation stopped at the end of the '
+                        'simulated time, patients may not reach surgery before it.')
+        elif runs_done < demo_trial_results_calculator.number_of_runs:
+            st.warning(f'Simulation stopped early - results are from {runs_done} of '
+                       f'{demo_trial_results_calculator.number_of_runs} runs.')
         st.subheader('Numbers on Waiting Lists')
-        st.text(f'At the start of the simulation, the total number of patients on the waiting list was {TOTAL_Q_START}.')
-        st.text(f'After {LENGTH_OF_SIM} days, the total number of patients on the waiting list is predicted to be {round(TOTAL_Q_END)}.')
-
-        demo_trial_results_calculator.readout_wait_time_end()
+        st.text(f'At the start of the simulation, the total number of patients on the waiting list was {st.session_state["total_q_start"]}.')
+        st.text(f'After {demo_trial_results_calculator.sim_duration} days, the total number of patients on the waiting list is predicted to be {round(TOTAL_Q_END)}.')
+        # the instant estimate is of the waiting list on the last day, which
+        # the simulation only counts when stopped then - otherwise it counts
+        # once every patient referred before then has had surgery
+        if 'projection' in st.session_state:
+            if st.session_state['stop_at_horizon']:
+                st.caption(f'The instant estimate from average appointment rates was {round(st.session_state["projection"]["total_q"])} '
+                           f'at {demo_trial_results_calculator.sim_duration} days.')
+            else:
+                st.caption(f'The instant estimate from average appointment rates was {round(st.session_state["projection"]["total_q"])} '
+                           f'on day {demo_trial_results_calculator.sim_duration}. The simulated number above is counted later, once every patient '
+                           f'referred before day {demo_trial_results_calculator.sim_duration} has had surgery, so the two are not directly comparable - '
+                           'stop at the end of the simulated time to compare them.')
 
         # plot the results
         st.subheader('Graphs of Waiting Times and Numbers on Waiting Lists')
         col1, col2 = st.columns(2)
         with col1:
-            st.plotly_chart(demo_trial_results_calculator.plot_wait_times())
+            if demo_trial_results_calculator.summary_mode:
+                st.plotly_chart(demo_trial_results_calculator.plot_wait_time_quantiles())
+            else:
+                st.plotly_chart(demo_trial_results_calculator.plot_wait_times())
         with col2:
             st.plotly_chart(demo_trial_results_calculator.plot_queue_numbers())
+
+        # waiting time percentiles and 18 week breaches
+        if demo_trial_results_calculator.summary_mode:
+            st.subheader('Waiting Times')
+            quantiles = demo_trial_results_calculator.readout_wait_time_quantiles()
+            if quantiles.loc['overall', 'patients'] == 0:
+                st.info('No patients referred reached surgery before the end of the simulation, so there are no waiting times to summarise.')
+            else:
+                st.text(f'{quantiles.loc["overall", "breach_pct"]:.1f}% of patients referred waited more than 18 weeks for surgery.')
+                st.dataframe(quantiles.round(1))
+
+        # waiting times estimated from runs stopped at the end of the
+        # simulated time, counting patients still waiting as censored
+        if demo_trial_results_calculator.censored_waits_df is not None and \
+                not demo_trial_results_calculator.summary_mode:
+            st.subheader('Waiting Times')
+            demo_trial_results_calculator.calculate_wait_time_survival()
+            still_waiting = len(demo_trial_results_calculator.censored_waits_df) / runs_done
+            median_wait = demo_trial_results_calculator.readout_wait_time_survival_quantile(0.5)
+            st.text(f'On average, {round(still_waiting)} patients referred during the simulation were still waiting at the end.')
+            if median_wait == median_wait:
+                st.text(f'Half of patients referred are estimated to wait less than {round(median_wait)} days for surgery.')
+            else:
+                st.text('Too few patients referred reached surgery to estimate the median wait.')
+            st.plotly_chart(demo_trial_results_calculator.plot_wait_time_survival(),
+                            use_container_width=True)
+
+        # plot the numbers in each queue through the simulation
+        if demo_trial_results_calculator.queue_lengths_df is not None:
+            demo_trial_results_calculator.calculate_queue_length_bands()
+            st.plotly_chart(demo_trial_results_calculator.plot_queue_lengths(),
+                            use_container_width=True)
+
+        st.dataframe(demo_trial_results_calculator.running_estimates().round(1))
+
+        # downloads are created in memory for this session, not written to
+        # the server, so sessions running at the same time cannot mix them up
+        if not demo_trial_results_calculator.summary_mode:
+            download_columns = st.columns(2)
+            for column, (file_name, data) in zip(
+                    download_columns,
+                    demo_trial_results_calculator.export_results_bytes().items()):
+                with column:
+                    st.download_button(f'Download {file_name}', data, file_name=file_name,
+                                       mime='application/octet-stream')
+
+    cache_stats = st.session_state['cache_stats']
+    st.caption(f'Results cache: {cache_stats["total_hits"]} hits, '
+               f'{cache_stats["total_misses"]} misses, '
+               f'{cache_stats["entries"]} scenarios stored')
@@ -0,0 +1,7 @@
+# the simulation modules are flat files in content/, imported by name as
+# the webapp and command line runners import them
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
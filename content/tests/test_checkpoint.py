@@ -0,0 +1,61 @@
+import pytest
+
+from Checkpoint import Pathway_Snapshot, run_with_checkpoints
+from HandPathway import Hand_Surgery_Pathway
+
+
+# a short run with a small backlog, so runs drain quickly
+short_run = {'seed': 3, 'sim_duration': 150, 'fill_clinic_q': 60, 'fill_imaging_q': 30,
+             'fill_therapy_q': 30, 'fill_theatre_q': 60}
+
+
+# a function to check two runs' results are exactly the same
+def assert_same_results(restored, full):
+    assert restored.wait_times_df().equals(full.wait_times_df())
+    assert restored.queue_numbers_row() == full.queue_numbers_row()
+    if full.queue_lengths is not None:
+        assert restored.queue_lengths_df().equals(full.queue_lengths_df())
+    if full.censored_waits is not None:
+        assert restored.censored_waits_df().equals(full.censored_waits_df())
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'stop_at_horizon': True},
+    {'common_random_numbers': True},
+    {'schedule': {'changes': [{'day': 60, 'referrals_per_week': 14}],
+                  'closures': [{'start': 120, 'end': 125}]}},
+])
+def test_restored_run_matches_uninterrupted_run(params):
+    full = Hand_Surgery_Pathway(0, **short_run, **params).run()
+
+    model = Hand_Surgery_Pathway(0, **short_run, **params)
+    model.run_until(100)
+    snapshot = Pathway_Snapshot.capture(model)
+
+    assert_same_results(snapshot.restore().finish(), full)
+    # a snapshot can be restored more than once
+    assert_same_results(snapshot.restore().finish(), full)
+
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    path = str(tmp_path / 'run.snapshot')
+    full = Hand_Surgery_Pathway(0, **short_run).run()
+
+    model = Hand_Surgery_Pathway(0, **short_run)
+    model.run_until(100)
+    Pathway_Snapshot.capture(model).save(path)
+
+    resumed = run_with_checkpoints(Hand_Surgery_Pathway(0, **short_run),
+                                   path, 50)
+    assert_same_results(resumed, full)
+
+
+def test_resuming_a_different_run_raises(tmp_path):
+    path = str(tmp_path / 'run.snapshot')
+    model = Hand_Surgery_Pathway(0, **short_run)
+    model.run_until(100)
+    Pathway_Snapshot.capture(model).save(path)
+
+    with pytest.raises(ValueError, match='seed'):
+        run_with_checkpoints(Hand_Surgery_Pathway(0, **{**short_run, 'seed': 4}), path, 50)
@@ -0,0 +1,13 @@
+from ParameterSweep import Parameter_Sweep
+
+
+def test_repeated_scenario_is_reported_once():
+    sweep = Parameter_Sweep(number_of_runs=2, max_workers=1, engine='slot', sim_duration=100)
+    scenarios = [{'theatre_list_per_week': 3}, {'theatre_list_per_week': 3},
+                 {'theatre_list_per_week': 4}]
+
+    # run once, then again from the cache
+    for i in range(2):
+        table = sweep.run(scenarios)
+        assert len(table) == 4
+        assert not table.duplicated(['scenario', 'run']).any()
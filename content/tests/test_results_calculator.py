@@ -0,0 +1,51 @@
+from ResultsCalculator import Trial_Results_Calculator
+from TrialRunner import Trial_Runner
+
+
+# runs of the slot engine, for a calculator of the same runs
+def trial_runs(number_of_runs=3, **params):
+    return Trial_Runner(number_of_runs, 1, max_workers=1, engine='slot',
+                        **params).run_trial()
+
+
+def test_summary_mode_with_stop_at_horizon_has_no_waits_to_summarise():
+    calculator = Trial_Results_Calculator(3, sim_duration=100, summary_mode=True)
+    calculator.add_run_results(trial_runs(sim_duration=100, stop_at_horizon=True))
+
+    quantiles = calculator.readout_wait_time_quantiles()
+    assert quantiles.loc['overall', 'patients'] == 0
+    assert len(calculator.plot_wait_time_quantiles().data) == 0
+
+
+def test_add_runs_adds_each_run_once():
+    calculator = Trial_Results_Calculator(3, sim_duration=100)
+    runner = Trial_Runner(3, 1, max_workers=1, engine='slot', sim_duration=100)
+    yielded = list(calculator.add_runs(runner))
+    assert len(yielded) == 3
+    assert calculator.run_results == yielded
+    assert calculator.running_stats['total_q'].count == 3
+
+
+def test_adaptive_runs_stop_once_precise():
+    calculator = Trial_Results_Calculator(40, sim_duration=100)
+    runner = Trial_Runner(40, 1, max_workers=1, engine='slot', sim_duration=100)
+    yielded = list(calculator.add_runs_until_precise(runner, relative_tolerance=0.25,
+                                                     min_runs=5))
+    assert calculator.stopping_reason == 'precision'
+    assert len(calculator.run_results) == len(yielded) < 40
+    assert calculator.is_precise(0.25)
+
+    # not precise a run earlier, unless that was before min_runs
+    if len(yielded) > 5:
+        earlier = Trial_Results_Calculator(40, sim_duration=100)
+        earlier.add_run_results(yielded[:-1])
+        assert not earlier.is_precise(0.25)
+
+
+def test_adaptive_runs_never_pass_max_runs():
+    calculator = Trial_Results_Calculator(6, sim_duration=100)
+    runner = Trial_Runner(6, 1, max_workers=1, engine='slot', sim_duration=100)
+    yielded = list(calculator.add_runs_until_precise(runner, relative_tolerance=1e-9,
+                                                     min_runs=2))
+    assert calculator.stopping_reason == 'max_runs'
+    assert len(yielded) == len(calculator.run_results) == 6
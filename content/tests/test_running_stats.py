@@ -0,0 +1,25 @@
+import math
+
+from RunningStats import Running_Stats
+
+
+def make_stats(values):
+    stats = Running_Stats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+def test_constant_zero_measure_is_precise():
+    stats = make_stats([0, 0, 0, 0, 0])
+    assert stats.mean == 0
+    assert stats.relative_half_width() == 0
+
+
+def test_relative_half_width_needs_two_values():
+    assert math.isnan(make_stats([5]).relative_half_width())
+
+
+def test_relative_half_width_of_varying_values():
+    stats = make_stats([9, 10, 11])
+    assert stats.relative_half_width() == stats.ci_half_width() / 10
@@ -0,0 +1,78 @@
+import math
+import random
+
+from HandPathway import Hand_Surgery_Pathway
+from Schedule import Pathway_Schedule, schedule_parameters
+from SlotPathway import Slot_Hand_Surgery_Pathway
+
+
+# a schedule that changes nothing during a run of sim_duration days - its
+# only closure is after the run
+def closed_after(sim_duration):
+    return {'closures': [{'start': 2 * sim_duration, 'end': 2 * sim_duration + 1}]}
+
+
+def compile_schedule(model, schedule):
+    return Pathway_Schedule(schedule, {name: getattr(model, name)
+                                       for name in schedule_parameters})
+
+
+def test_compiled_schedule_matches_constant_rate_sessions():
+    model = Hand_Surgery_Pathway(0)
+    calendars = compile_schedule(model, closed_after(365)).stage_calendars(365)
+
+    for stage, interval, duration in [
+            ('clinic_q', model.surg_clinic_interval, model.surg_clinic_duration),
+            ('theatre_q', model.theatre_list_interval, model.theatre_case_duration)]:
+        calendar = calendars[stage]
+        opens = 0.0
+        for i in range(20):
+            assert calendar.opens[i] == opens
+            assert calendar.closes[i] == opens + 1
+            assert math.isclose(calendar.durations[i], duration)
+            opens += 1 + interval
+
+    for stage, interval in [('imaging_q', model.imaging_interval),
+                            ('therapy_q', model.therapy_interval)]:
+        for now in (0.0, 17.3, 364.9):
+            assert calendars[stage].book(now) == (0, interval)
+
+
+def test_compiled_referrals_match_constant_rate():
+    model = Hand_Surgery_Pathway(0)
+    schedule = compile_schedule(model, closed_after(365))
+    scheduled, constant = random.Random(1), random.Random(1)
+    now = 0.0
+    for i in range(1000):
+        delay = schedule.referral_delay(now, scheduled)
+        assert delay == constant.expovariate(1.0 / model.referral_interval)
+        now += delay
+
+
+def test_empty_schedule_runs_as_no_schedule():
+    unscheduled = Hand_Surgery_Pathway(0, seed=1, sim_duration=365).run()
+    empty = Hand_Surgery_Pathway(0, seed=1, sim_duration=365, schedule={}).run()
+    assert unscheduled.wait_times_df().equals(empty.wait_times_df())
+    assert unscheduled.queue_numbers_row() == empty.queue_numbers_row()
+
+
+def test_no_appointment_starts_in_a_closure():
+    model = Hand_Surgery_Pathway(0)
+    schedule = compile_schedule(model, {'closures': [{'start': 10, 'end': 20}]})
+    calendars = schedule.stage_calendars(365)
+    for calendar in calendars.values():
+        wait, appointment = calendar.book(12.5)
+        assert 12.5 + wait >= 20
+
+
+def test_slot_engine_matches_simpy_under_schedule():
+    schedule = {'changes': [{'day': 100, 'referrals_per_week': 14},
+                            {'day': 200, 'theatre_list_per_week': 3}],
+                'closures': [{'start': 150, 'end': 155},
+                             {'start': 250, 'end': 260, 'stages': ['theatres']}]}
+    simpy_run, slot_run = [
+        engine(0, seed=2, sim_duration=365, schedule=schedule).run()
+        for engine in (Hand_Surgery_Pathway, Slot_Hand_Surgery_Pathway)]
+    assert sorted(simpy_run.wait_times.overall_q_time) == \
+        sorted(slot_run.wait_times.overall_q_time)
+    assert simpy_run.queue_numbers_row() == slot_run.queue_numbers_row()